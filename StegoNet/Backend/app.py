@@ -1,27 +1,48 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
 import sqlite3
 import torch
-import torchvision.transforms as transforms
 from PIL import Image, ImageDraw, ImageFont
 import io
 import base64
+import hashlib
 import os
+import time
 import logging
-from models import PreparationNetwork, HidingNetwork, RevealNetwork, tensor_to_pil, pil_to_bytes
+import threading
+from functools import partial
+from models import tensor_to_pil, pil_to_bytes
+from scheduler import BatchScheduler
+from pipeline import load_networks, warm_up
+from registry import ModelRegistry, ModelVersion
+from precision import PRECISIONS, DEFAULT_MIN_PSNR, DEFAULT_MIN_SSIM
+from preprocess import image_to_tensor
+from tiling import hide_tiled, reveal_tiled
+from blobstore import open_blob_store, add_ref, release_refs
+from secret_cache import SecretCache
+from db import Database
+from jobs import JobQueue, QueueFull
+from ingest import open_upload, UploadRejected
+from transport import JSON_MIMETYPE, MULTIPART_MIMETYPE, negotiate, not_acceptable, encode_image, json_response, image_response, multipart_response
+import metrics
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Per-step request logging is at DEBUG; set STEGONET_LOG_LEVEL=DEBUG to see it
+logging.basicConfig(level=os.environ.get("STEGONET_LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Instrumentation, exposed at /metrics in Prometheus text format
+REQUEST_SECONDS = metrics.histogram("stegonet_request_seconds", "HTTP request latency by endpoint", ("endpoint", "method", "status"))
+STAGE_SECONDS = metrics.histogram("stegonet_stage_seconds", "Latency of pipeline stages: decode, network forwards, encode and database access", ("stage",))
+MOCK_RESPONSES = metrics.counter("stegonet_mock_responses_total", "Requests answered with mock images because no models are loaded", ("endpoint",))
+ERRORS = metrics.counter("stegonet_errors_total", "Requests that ended in a 5xx response", ("endpoint",))
+
 app = Flask(__name__)
-CORS(app)
+# Raw image responses carry their metadata in headers, which browsers only expose when listed
+CORS(app, expose_headers=["X-Message-Id", "X-StegoNet-Message"])
 
 # Initialize models with error handling
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-prep_net = None
-hide_net = None
-reveal_net = None
 models_loaded = False
 mock_mode = False  # Enable mock mode for testing without models
 
@@ -29,8 +50,42 @@ mock_mode = False  # Enable mock mode for testing without models
 MEAN = [0.485, 0.456, 0.406]
 STD = [0.229, 0.224, 0.225]
 
-# Supported image formats
-SUPPORTED_FORMATS = {'PNG', 'JPEG', 'JPG'}
+# Upload limits. Request bodies over STEGONET_MAX_REQUEST_BYTES are refused before they are read;
+# each image is then checked by size, magic bytes and header dimensions before it is decoded.
+MAX_REQUEST_BYTES = int(os.environ.get("STEGONET_MAX_REQUEST_BYTES", 64 * 1024 * 1024))
+MAX_UPLOAD_BYTES = int(os.environ.get("STEGONET_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get("STEGONET_MAX_IMAGE_PIXELS", 40_000_000))
+MAX_TILED_PIXELS = int(os.environ.get("STEGONET_MAX_TILED_PIXELS", 40_000_000))
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+# PIL's own decompression-bomb guard, for any image opened outside open_upload. Stored tiled
+# stego images are reopened for reveals, so it has to admit the largest tiled cover too.
+Image.MAX_IMAGE_PIXELS = max(MAX_IMAGE_PIXELS, MAX_TILED_PIXELS)
+
+# Response encoding. Images are stored as PNG; clients can negotiate JSON with base64 (the
+# default), raw image/png or lossless image/webp, or multipart/mixed for batches and inbox pages.
+# Lower compression levels encode faster and produce larger files.
+PNG_COMPRESS_LEVEL = int(os.environ.get("STEGONET_PNG_COMPRESS_LEVEL", 6))
+WEBP_METHOD = int(os.environ.get("STEGONET_WEBP_METHOD", 4))
+IMAGE_OFFERS = [JSON_MIMETYPE, "image/png", "image/webp"]
+BATCH_OFFERS = [JSON_MIMETYPE, MULTIPART_MIMETYPE]
+
+# Inference engine: "fused" builds branch-fused channels_last copies of the networks,
+# "reference" runs the modules from models.py as-is
+ENGINE_MODE = os.environ.get("STEGONET_ENGINE", "fused")
+ENGINE_COMPILE = os.environ.get("STEGONET_ENGINE_COMPILE", "none")
+
+# Inference precision: "fp32", "bf16" (autocast) or "int8" (static quantization calibrated on
+# STEGONET_CALIBRATION_DIR, or synthetic images if unset). A reduced precision whose stego or
+# revealed output falls below the PSNR/SSIM thresholds against fp32 is refused at startup.
+PRECISION = os.environ.get("STEGONET_PRECISION", "fp32").lower()
+if PRECISION not in PRECISIONS:
+    logger.error(f"Unknown STEGONET_PRECISION '{PRECISION}', expected one of {list(PRECISIONS)}; using fp32")
+    PRECISION = "fp32"
+PRECISION_OPTIONS = {
+    "calibration_dir": os.environ.get("STEGONET_CALIBRATION_DIR") or None,
+    "min_psnr": float(os.environ.get("STEGONET_PRECISION_MIN_PSNR", DEFAULT_MIN_PSNR)),
+    "min_ssim": float(os.environ.get("STEGONET_PRECISION_MIN_SSIM", DEFAULT_MIN_SSIM)),
+}
 
 model_files = {
     "prep_net": "preparation_network.pth",
@@ -38,8 +93,30 @@ model_files = {
     "reveal_net": "reveal_network.pth"
 }
 
+# Startup: STEGONET_PRELOAD is set by gunicorn.conf.py, where this module is imported once in the
+# master and workers inherit the loaded networks copy-on-write. Otherwise STEGONET_BACKGROUND_LOAD
+# lets the server accept requests (answering 503 and /readyz "loading") while models load.
+PRELOAD = os.environ.get("STEGONET_PRELOAD", "0").lower() in ("1", "true", "yes")
+BACKGROUND_LOAD = os.environ.get("STEGONET_BACKGROUND_LOAD", "0").lower() in ("1", "true", "yes")
+WARMUP = os.environ.get("STEGONET_WARMUP", "1").lower() in ("1", "true", "yes")
+
+# Model versions: weight sets are archived by hash in STEGONET_MODEL_DIR and every message records
+# the version that hid it. New .pth files are picked up by a watcher, loaded and warmed up in the
+# background and swapped in; requests already running finish on the version they started with.
+MODEL_DIR = os.environ.get("STEGONET_MODEL_DIR", "model_versions")
+MODEL_POLL_SECONDS = float(os.environ.get("STEGONET_MODEL_POLL_SECONDS", 10))
+MODEL_MAX_LOADED = int(os.environ.get("STEGONET_MODEL_MAX_LOADED", 2))
+
+def load_version(files):
+    prep, hide, reveal, weights, precision = load_networks(files, device, ENGINE_MODE, ENGINE_COMPILE, PRECISION, **PRECISION_OPTIONS)
+    if WARMUP:
+        started = time.perf_counter()
+        warm_up(prep, hide, reveal, device)
+        logger.info(f"Warm-up forward pass took {(time.perf_counter() - started) * 1000:.0f} ms")
+    return ModelVersion(weights, prep, hide, reveal, precision)
+
 def load_models():
-    global prep_net, hide_net, reveal_net, models_loaded, mock_mode
+    global mock_mode
     logger.info(f"Current working directory: {os.getcwd()}")
     logger.info(f"Checking for model files: {list(model_files.values())}")
     
@@ -50,44 +127,246 @@ def load_models():
         return False
 
     try:
-        prep_net = PreparationNetwork().to(device)
-        hide_net = HidingNetwork().to(device)
-        reveal_net = RevealNetwork().to(device)
-
-        prep_net.load_state_dict(torch.load(model_files["prep_net"], map_location=device))
-        hide_net.load_state_dict(torch.load(model_files["hide_net"], map_location=device))
-        reveal_net.load_state_dict(torch.load(model_files["reveal_net"], map_location=device))
-        prep_net.eval()
-        hide_net.eval()
-        reveal_net.eval()
-        logger.info("Models loaded successfully.")
-        models_loaded = True
+        model = model_registry.deploy(model_files)
+        logger.info(f"Models loaded successfully ({model.precision}, version {model.version[:12]}).")
+        on_model_activated(model)
         return True
     except Exception as e:
         logger.error(f"Error loading models: {str(e)}. Enabling mock mode.")
         mock_mode = True
         return False
 
-models_loaded = load_models()
+# Micro-batching of concurrent hide/reveal requests into single forward passes
+BATCH_MAX_SIZE = int(os.environ.get("STEGONET_BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("STEGONET_BATCH_MAX_WAIT_MS", 5))
+
+def per_model(forward):
+    # Payloads start with the ModelVersion they were submitted for. A batch is split by version
+    # so no forward pass mixes weights, which only happens around a swap.
+    def handler(items):
+        groups = {}
+        for index, (model, *payload) in enumerate(items):
+            groups.setdefault(model, []).append((index, payload))
+        results = [None] * len(items)
+        for model, members in groups.items():
+            for (index, _), result in zip(members, forward(model, [payload for _, payload in members])):
+                results[index] = result
+        return results
+    return handler
+
+def hide_batch(model, items):
+    cover_batch = torch.cat([cover for cover, _ in items]).to(device)
+    secret_batch = torch.cat([secret for _, secret in items]).to(device)
+    with torch.no_grad():
+        with STAGE_SECONDS.time(stage="prep_net"):
+            prepared_secret = model.prep_net(secret_batch)
+        if prepared_secret.shape[1] != 65:  # Expected output channels from PreparationNetwork
+            raise RuntimeError(f"PreparationNetwork output shape mismatch: {tuple(prepared_secret.shape)}")
+        with STAGE_SECONDS.time(stage="hide_net"):
+            stego_batch = model.hide_net(cover_batch, prepared_secret)
+    return list(stego_batch.split(1))
+
+def prepare_batch(model, items):
+    secret_batch = torch.cat([secret for secret, in items]).to(device)
+    with torch.no_grad(), STAGE_SECONDS.time(stage="prep_net"):
+        prepared_secret = model.prep_net(secret_batch)
+    return list(prepared_secret.split(1))
+
+def hide_prepared_batch(model, items):
+    # Covers paired with secrets already run through PreparationNetwork
+    cover_batch = torch.cat([cover for cover, _ in items]).to(device)
+    prepared_batch = torch.cat([prepared for _, prepared in items]).to(device)
+    with torch.no_grad(), STAGE_SECONDS.time(stage="hide_net"):
+        stego_batch = model.hide_net(cover_batch, prepared_batch)
+    return list(stego_batch.split(1))
+
+def reveal_batch(model, items):
+    stego_batch = torch.cat([stego for stego, in items]).to(device)
+    with torch.no_grad(), STAGE_SECONDS.time(stage="reveal_net"):
+        revealed_batch = model.reveal_net(stego_batch)
+    return list(revealed_batch.split(1))
+
+scheduler = BatchScheduler(max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+scheduler.register("hide", per_model(hide_batch))
+scheduler.register("reveal", per_model(reveal_batch))
+scheduler.register("prepare", per_model(prepare_batch))
+scheduler.register("hide_prepared", per_model(hide_prepared_batch))
+
+# Tiled full-resolution mode: images are processed as overlapping 256x256 tiles
+TILED_DEFAULT = os.environ.get("STEGONET_TILED", "0").lower() in ("1", "true", "yes")
+TILE_OVERLAP = int(os.environ.get("STEGONET_TILE_OVERLAP", 32))
+TILE_BATCH = int(os.environ.get("STEGONET_TILE_BATCH", 8))
+
+def hide_tiles(model, cover_batch, secret_batch):
+    futures = [scheduler.submit("hide", model, cover, secret) for cover, secret in zip(cover_batch.split(1), secret_batch.split(1))]
+    return torch.cat([future.result() for future in futures])
+
+def reveal_tiles(model, stego_batch):
+    futures = [scheduler.submit("reveal", model, stego) for stego in stego_batch.split(1)]
+    return torch.cat([future.result() for future in futures])
+
+# Bulk sends through /api/send-stego-batch
+BATCH_SEND_MAX_ITEMS = int(os.environ.get("STEGONET_BATCH_SEND_MAX_ITEMS", 100))
+
+# Inbox pagination
+INBOX_PAGE_SIZE = int(os.environ.get("STEGONET_INBOX_PAGE_SIZE", 50))
+INBOX_MAX_PAGE_SIZE = int(os.environ.get("STEGONET_INBOX_MAX_PAGE_SIZE", 200))
+
+# Stego image bytes live in a content-addressed blob store; messages only keep the hash
+BLOB_STORE_KIND = os.environ.get("STEGONET_BLOB_STORE", "local")
+BLOB_DIR = os.environ.get("STEGONET_BLOB_DIR", "blobs")
+blob_store = open_blob_store(BLOB_STORE_KIND, BLOB_DIR)
+# "stego_image" until migrate_blobs.py has moved legacy BLOB rows out of users.db
+legacy_image_column = "NULL"
+
+# Revealed secrets for repeated extract-secret calls on the same message
+SECRET_CACHE_MAX_BYTES = int(os.environ.get("STEGONET_SECRET_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+SECRET_CACHE_MAX_ENTRIES = int(os.environ.get("STEGONET_SECRET_CACHE_MAX_ENTRIES", 256))
+SECRET_CACHE_DIR = os.environ.get("STEGONET_SECRET_CACHE_DIR") or None
+SECRET_CACHE_DISK_MAX_BYTES = int(os.environ.get("STEGONET_SECRET_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+secret_cache = SecretCache(max_bytes=SECRET_CACHE_MAX_BYTES, max_entries=SECRET_CACHE_MAX_ENTRIES,
+                           disk_dir=SECRET_CACHE_DIR, disk_max_bytes=SECRET_CACHE_DISK_MAX_BYTES)
+
+# Database setup: pooled WAL-mode connections, schema managed by db.MIGRATIONS
+DB_PATH = os.environ.get("STEGONET_DB", "users.db")
+DB_POOL_SIZE = int(os.environ.get("STEGONET_DB_POOL_SIZE", 8))
+db = Database(DB_PATH, pool_size=DB_POOL_SIZE)
 
-# Database setup
 def init_db():
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE,
-                    password TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender TEXT,
-                    receiver TEXT,
-                    stego_image BLOB)''')
-    conn.commit()
-    conn.close()
+    global legacy_image_column
+    db.migrate()
+    legacy_image_column = "stego_image" if "stego_image" in db.columns("messages") else "NULL"
+    if legacy_image_column != "NULL":
+        legacy_rows = db.query_one("SELECT COUNT(*) FROM messages WHERE stego_image IS NOT NULL")[0]
+        if legacy_rows:
+            logger.warning(f"{legacy_rows} messages still store images in users.db. Run migrate_blobs.py to move them to the blob store.")
+
+def read_message_image(image_hash, legacy_image):
+    if image_hash:
+        return blob_store.read(image_hash)
+    return legacy_image
+
+def stego_cache_key(image_hash, legacy_image):
+    # Revealed secrets are cached under the blob hash, or the hash of the bytes for legacy rows
+    if image_hash or legacy_image is None:
+        return image_hash
+    return hashlib.sha256(legacy_image).hexdigest()
+
+def delete_message_images(c, rows):
+    # rows: (image_hash, legacy image) of the deleted messages. Called inside the write
+    # transaction so a concurrent send cannot re-reference a blob being removed.
+    for image_hash in release_refs(c, [image_hash for image_hash, _ in rows]):
+        blob_store.delete(image_hash)
+    secret_cache.purge([stego_cache_key(image_hash, legacy_image) for image_hash, legacy_image in rows])
+
+def save_messages(messages):
+    # messages: (sender, receiver, image_bytes, model_version) tuples, written in one transaction
+    message_ids = []
+    with STAGE_SECONDS.time(stage="db_write"), db.transaction(immediate=True) as c:
+        for sender, receiver, image_bytes, model_version in messages:
+            image_hash = blob_store.put(image_bytes)
+            add_ref(c, image_hash, len(image_bytes))
+            c.execute("INSERT INTO messages (sender, receiver, image_hash, image_size, created_at, model_version) VALUES (?, ?, ?, ?, ?, ?)",
+                      (sender, receiver, image_hash, len(image_bytes), int(time.time()), model_version))
+            message_ids.append(c.lastrowid)
+    return message_ids
+
+def save_message(sender, receiver, image_bytes, model_version=None):
+    return save_messages([(sender, receiver, image_bytes, model_version)])[0]
 
 init_db()
 
+model_registry = ModelRegistry(db, MODEL_DIR, load_version, max_loaded=MODEL_MAX_LOADED)
+
+def on_model_activated(model):
+    global models_loaded, mock_mode
+    models_loaded, mock_mode = True, False
+    if job_queue is not None:
+        job_queue.reload(model_registry.files(model.version))
+
+def model_for(version):
+    # The weights that hid a message. Messages from before versions were recorded, or whose
+    # version is no longer archived, are revealed with the active weights.
+    active = model_registry.active
+    if version is None or version == active.version:
+        return active
+    model = model_registry.get(version)
+    if model is None:
+        logger.warning(f"Model version {version[:12]} is not archived, revealing with {active.version[:12]}")
+        return active
+    return model
+
+job_queue = None
+if BACKGROUND_LOAD and not PRELOAD:
+    threading.Thread(target=load_models, name="stegonet-model-loader", daemon=True).start()
+else:
+    load_models()
+
+# Asynchronous send-stego: jobs persisted in the jobs table, inference in worker processes
+ASYNC_SEND = os.environ.get("STEGONET_ASYNC_SEND", "0").lower() in ("1", "true", "yes")
+ASYNC_WORKERS = int(os.environ.get("STEGONET_ASYNC_WORKERS", 2))
+ASYNC_MAX_PENDING = int(os.environ.get("STEGONET_ASYNC_MAX_PENDING", 32))
+ASYNC_SPOOL_DIR = os.environ.get("STEGONET_ASYNC_SPOOL_DIR", "job_spool")
+ASYNC_MAX_WAIT = float(os.environ.get("STEGONET_ASYNC_MAX_WAIT", 30))
+ASYNC_JOB_RETENTION = float(os.environ.get("STEGONET_ASYNC_JOB_RETENTION", 86400))
+if ASYNC_SEND and all(os.path.exists(f) for f in model_files.values()):
+    # Workers load and quality-check the networks themselves, so this does not wait for load_models().
+    # They run the archived copy of the active version once there is one (see on_model_activated).
+    active = model_registry.active
+    job_queue = JobQueue(db, ASYNC_SPOOL_DIR, save_message, model_registry.files(active.version) if active else model_files, MEAN, STD,
+                         workers=ASYNC_WORKERS, max_pending=ASYNC_MAX_PENDING,
+                         engine_mode=ENGINE_MODE, compile_mode=ENGINE_COMPILE,
+                         precision=PRECISION, precision_options=PRECISION_OPTIONS,
+                         overlap=TILE_OVERLAP, tile_batch=TILE_BATCH, compress_level=PNG_COMPRESS_LEVEL,
+                         retention=ASYNC_JOB_RETENTION)
+
+def start_background_services():
+    # Threads do not survive fork, so under a preloading server each worker calls this after forking
+    if job_queue is not None:
+        job_queue.start()
+    model_registry.start_watcher(model_files, MODEL_POLL_SECONDS, on_activate=on_model_activated)
+
+if not PRELOAD:
+    start_background_services()
+
+# Scrape-time gauges and request-level instrumentation
+metrics.gauge("stegonet_scheduler_queue_depth", "Inference requests waiting for a batch", ("kind",),
+              function=lambda: {(kind,): stats["queue_depth"] for kind, stats in scheduler.stats()["kinds"].items()})
+metrics.gauge("stegonet_models_loaded", "1 when the steganography networks are loaded", function=lambda: int(models_loaded))
+
+# Sampling profiler for slow requests; STEGONET_PROFILE_SLOW_MS=0 disables it
+PROFILE_SLOW_MS = float(os.environ.get("STEGONET_PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("STEGONET_PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.environ.get("STEGONET_PROFILE_DIR", "profiles")
+profiler = None
+if PROFILE_SLOW_MS > 0:
+    profiler = metrics.SlowRequestProfiler(PROFILE_SLOW_MS, PROFILE_DIR, interval_ms=PROFILE_INTERVAL_MS,
+                                           extra_threads=lambda: [scheduler.thread])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if profiler is not None:
+        profiler.begin()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if response.status_code >= 500:
+        ERRORS.inc(endpoint=endpoint)
+    if profiler is not None:
+        profiler.end(f"{request.method}-{endpoint}", elapsed)
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Request body is larger than {MAX_REQUEST_BYTES} bytes"}), 413
+
 # Authentication routes
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -96,15 +375,11 @@ def register():
     password = data.get('password')
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        conn.commit()
-        conn.close()
+        with db.transaction() as c:
+            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
         return jsonify({"message": "Registered successfully"}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({"error": "Username already exists"}), 400
 
 @app.route('/api/login', methods=['POST'])
@@ -114,11 +389,7 @@ def login():
     password = data.get('password')
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-    user = c.fetchone()
-    conn.close()
+    user = db.query_one("SELECT * FROM users WHERE username=? AND password=?", (username, password))
     if user:
         return jsonify({"message": "Login successful", "username": username}), 200
     return jsonify({"error": "Invalid credentials"}), 401
@@ -134,11 +405,7 @@ def admin_login():
 
 @app.route('/api/users', methods=['GET'])
 def get_users():
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT username FROM users")
-    users = [user[0] for user in c.fetchall()]
-    conn.close()
+    users = [user[0] for user in db.query("SELECT username FROM users")]
     return jsonify(users)
 
 # Image processing routes
@@ -152,25 +419,31 @@ def send_stego():
     receiver = request.form.get('receiver')
     cover_file = request.files.get('cover_image')
     secret_file = request.files.get('secret_image')
+    tiled = request.form.get('tiled', str(TILED_DEFAULT)).lower() in ("1", "true", "yes")
 
     if not all([sender, receiver, cover_file, secret_file]):
         logger.error(f"Missing required fields: sender={sender}, receiver={receiver}, cover_file={cover_file}, secret_file={secret_file}")
         return jsonify({"error": "Missing required fields: sender, receiver, cover_image, and secret_image are required"}), 400
+    mimetype = negotiate(IMAGE_OFFERS)
+    if mimetype is None:
+        return not_acceptable(IMAGE_OFFERS)
 
     try:
-        # Validate image files
-        logger.info("Validating image files")
-        cover_filename = cover_file.filename
-        secret_filename = secret_file.filename
-        cover_ext = cover_filename.rsplit('.', 1)[1].upper() if '.' in cover_filename else ''
-        secret_ext = secret_filename.rsplit('.', 1)[1].upper() if '.' in secret_filename else ''
-        
-        if cover_ext not in SUPPORTED_FORMATS or secret_ext not in SUPPORTED_FORMATS:
-            logger.error(f"Unsupported image format: cover={cover_ext}, secret={secret_ext}")
-            return jsonify({"error": f"Unsupported image format. Supported formats are {SUPPORTED_FORMATS}"}), 400
+        # Only headers are parsed here; pixels are decoded below at the size each path needs
+        logger.debug("Validating image files")
+        try:
+            cover_image = open_upload(cover_file, MAX_UPLOAD_BYTES, MAX_TILED_PIXELS if tiled else MAX_IMAGE_PIXELS, name="cover_image")
+            secret_image = open_upload(secret_file, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, name="secret_image")
+        except UploadRejected as e:
+            logger.warning(f"Rejected upload from {sender}: {str(e)}")
+            return jsonify({"error": str(e)}), e.status
+
+        if job_queue is not None and request.form.get('async', '1').lower() in ("1", "true", "yes"):
+            return enqueue_send(sender, receiver, cover_file, secret_file, tiled)
 
         if mock_mode:
-            logger.info("Mock mode: Returning dummy stego image")
+            logger.debug("Mock mode: Returning dummy stego image")
+            MOCK_RESPONSES.inc(endpoint="send_stego")
             # Create a dummy image with a label
             dummy_image = Image.new('RGB', (256, 256), color='gray')
             draw = ImageDraw.Draw(dummy_image)
@@ -179,102 +452,268 @@ def send_stego():
             except AttributeError:
                 font = ImageFont.load_default()
             draw.text((10, 10), "Mock Stego Image\nModels Missing", fill="white", font=font)
-            image_bytes = pil_to_bytes(dummy_image)
+            stego_pil = dummy_image
+            image_bytes = pil_to_bytes(dummy_image, compress_level=PNG_COMPRESS_LEVEL)
+            model = None
         else:
-            logger.info("Opening cover and secret images")
-            cover_image = Image.open(cover_file).convert("RGB")
-            secret_image = Image.open(secret_file).convert("RGB")
-
-            # Validate image dimensions
+            # Held for the whole request, so a model swap meanwhile does not affect it
+            model = model_registry.active
             cover_size = cover_image.size
-            secret_size = secret_image.size
-            logger.info(f"Cover image size: {cover_size}, Secret image size: {secret_size}")
-            if cover_size[0] < 256 or cover_size[1] < 256 or secret_size[0] < 256 or secret_size[1] < 256:
-                logger.error("Image dimensions too small")
-                return jsonify({"error": "Images must be at least 256x256 pixels"}), 400
-
-            logger.info("Setting up image transforms")
-            transform = transforms.Compose([
-                transforms.Resize((256, 256)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=MEAN, std=STD)
-            ])
-
-            logger.info("Transforming images to tensors")
-            cover_tensor = transform(cover_image).unsqueeze(0).to(device)
-            secret_tensor = transform(secret_image).unsqueeze(0).to(device)
-            logger.info(f"Cover tensor shape: {cover_tensor.shape}, Secret tensor shape: {secret_tensor.shape}")
-
-            if cover_tensor.shape != (1, 3, 256, 256) or secret_tensor.shape != (1, 3, 256, 256):
-                logger.error(f"Invalid tensor shapes: cover={cover_tensor.shape}, secret={secret_tensor.shape}")
-                return jsonify({"error": "Image tensors have invalid shapes. Expected (1, 3, 256, 256)"}), 500
-
-            logger.info("Running PreparationNetwork")
-            with torch.no_grad():
-                prepared_secret = prep_net(secret_tensor)
-                logger.info(f"Prepared secret shape: {prepared_secret.shape}")
-                if prepared_secret.shape[1] != 65:  # Expected output channels from PreparationNetwork
-                    logger.error(f"PreparationNetwork output shape mismatch: {prepared_secret.shape}")
-                    return jsonify({"error": "PreparationNetwork output shape mismatch"}), 500
-
-            logger.info("Running HidingNetwork")
-            with torch.no_grad():
-                # Combine cover_tensor and prepared_secret for HidingNetwork
-                stego_image = hide_net(cover_tensor, prepared_secret)
-                logger.info(f"Stego tensor shape: {stego_image.shape}")
+            logger.debug(f"Cover image size: {cover_size}, Secret image size: {secret_image.size}")
+            if tiled:
+                logger.debug(f"Running tiled hiding at {cover_size[0]}x{cover_size[1]}")
+                with STAGE_SECONDS.time(stage="decode"):
+                    # Bands are converted to RGB as they are tiled, so only the decode is timed here
+                    cover_image.load()
+                    secret_image.load()
+                with STAGE_SECONDS.time(stage="tiled_hide"):
+                    stego_pil = hide_tiled(cover_image, secret_image, partial(hide_tiles, model), MEAN, STD,
+                                           overlap=TILE_OVERLAP, batch_size=TILE_BATCH)
+                logger.debug("Converting stego image to bytes")
+                with STAGE_SECONDS.time(stage="encode"):
+                    image_bytes = pil_to_bytes(stego_pil, compress_level=PNG_COMPRESS_LEVEL)
+            else:
+                logger.debug("Transforming images to tensors")
+                with STAGE_SECONDS.time(stage="decode"):
+                    cover_tensor = image_to_tensor(cover_image, MEAN, STD, device=device)
+                    secret_tensor = image_to_tensor(secret_image, MEAN, STD, device=device)
+                logger.debug(f"Cover tensor shape: {cover_tensor.shape}, Secret tensor shape: {secret_tensor.shape}")
+
+                if cover_tensor.shape != (1, 3, 256, 256) or secret_tensor.shape != (1, 3, 256, 256):
+                    logger.error(f"Invalid tensor shapes: cover={cover_tensor.shape}, secret={secret_tensor.shape}")
+                    return jsonify({"error": "Image tensors have invalid shapes. Expected (1, 3, 256, 256)"}), 500
+
+                logger.debug("Running PreparationNetwork and HidingNetwork")
+                stego_image = scheduler.run("hide", model, cover_tensor, secret_tensor)
+                logger.debug(f"Stego tensor shape: {stego_image.shape}")
                 if stego_image.shape != (1, 3, 256, 256):
                     logger.error(f"HidingNetwork output shape mismatch: {stego_image.shape}")
                     return jsonify({"error": "HidingNetwork output shape mismatch. Expected (1, 3, 256, 256)"}), 500
 
-            logger.info("Converting stego tensor to PIL image")
-            stego_pil = tensor_to_pil(stego_image, MEAN, STD)
-            logger.info("Converting stego image to bytes")
-            image_bytes = pil_to_bytes(stego_pil)
-
-        logger.info("Saving stego image to database")
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("INSERT INTO messages (sender, receiver, stego_image) VALUES (?, ?, ?)", (sender, receiver, image_bytes))
-        conn.commit()
-        conn.close()
-
-        return jsonify({
-            "message": "Stego image sent" + (" (mock mode - no models loaded)" if mock_mode else ""),
-            "stego_image": base64.b64encode(image_bytes).decode('utf-8')
-        }), 200
+                logger.debug("Converting stego tensor to PNG bytes")
+                with STAGE_SECONDS.time(stage="encode"):
+                    stego_pil = tensor_to_pil(stego_image, MEAN, STD)
+                    image_bytes = pil_to_bytes(stego_pil, compress_level=PNG_COMPRESS_LEVEL)
+
+        logger.debug("Saving stego image to database")
+        message_id = save_message(sender, receiver, image_bytes, model.version if model else None)
+
+        message = "Stego image sent" + (" (mock mode - no models loaded)" if mock_mode else "")
+        if mimetype == JSON_MIMETYPE:
+            return json_response({
+                "message": message,
+                "message_id": message_id,
+                "stego_image": base64.b64encode(image_bytes).decode('utf-8')
+            })
+        # The stored PNG goes out as-is; only a WebP response needs another encode, and only
+        # that one is timed so a PNG send is not counted twice under the encode stage
+        if mimetype == "image/png":
+            body = encode_image(stego_pil, mimetype, image_bytes, WEBP_METHOD)
+        else:
+            with STAGE_SECONDS.time(stage="encode"):
+                body = encode_image(stego_pil, mimetype, image_bytes, WEBP_METHOD)
+        return image_response(body, mimetype, {"X-Message-Id": message_id, "X-StegoNet-Message": message})
     except Exception as e:
         logger.error(f"Error processing stego image: {str(e)}")
         return jsonify({"error": f"Failed to process images: {str(e)}"}), 500
 
+@app.route('/api/send-stego-batch', methods=['POST'])
+def send_stego_batch():
+    # Form fields: sender, secret_image (shared by every item) and, for i = 0..N-1,
+    # receiver_<i>, cover_image_<i> and optionally secret_image_<i> to override the shared secret
+    if not models_loaded and not mock_mode:
+        logger.warning("Steganography models not loaded, returning 503")
+        return jsonify({"error": "Steganography models are not loaded. Ensure .pth files are in the backend directory."}), 503
+
+    sender = request.form.get('sender')
+    count = 0
+    while f"receiver_{count}" in request.form:
+        count += 1
+    if not sender or count == 0:
+        return jsonify({"error": "sender and at least one receiver_0/cover_image_0 pair are required"}), 400
+    if count > BATCH_SEND_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_SEND_MAX_ITEMS} items per batch"}), 400
+    mimetype = negotiate(BATCH_OFFERS)
+    if mimetype is None:
+        return not_acceptable(BATCH_OFFERS)
+
+    shared_secret = request.files.get('secret_image')
+    shared_secret_bytes = shared_secret.read(MAX_UPLOAD_BYTES + 1) if shared_secret else None
+    results = [{"index": i, "receiver": request.form.get(f"receiver_{i}")} for i in range(count)]
+    # Items are grouped by secret content so PreparationNetwork runs once per distinct secret
+    groups = {}
+    secret_bytes_by_hash = {}
+    covers = {}
+    try:
+        for i, result in enumerate(results):
+            cover_file = request.files.get(f"cover_image_{i}")
+            secret_file = request.files.get(f"secret_image_{i}")
+            secret_bytes = secret_file.read(MAX_UPLOAD_BYTES + 1) if secret_file else shared_secret_bytes
+            if not result["receiver"] or not cover_file or secret_bytes is None:
+                result["error"] = "receiver, cover_image and secret_image are required"
+                continue
+            # Only headers are parsed here; covers are decoded one group at a time below
+            secret_hash = hashlib.sha256(secret_bytes).hexdigest()
+            try:
+                if secret_hash not in secret_bytes_by_hash:
+                    open_upload(secret_bytes, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, name=f"secret_image_{i}")
+                covers[i] = open_upload(cover_file, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, name=f"cover_image_{i}")
+            except UploadRejected as e:
+                result["error"] = str(e)
+                continue
+            secret_bytes_by_hash[secret_hash] = secret_bytes
+            groups.setdefault(secret_hash, []).append(i)
+
+        logger.debug(f"Batch send from {sender}: {len(covers)} valid items, {len(groups)} distinct secrets")
+        outputs = {}
+        if mock_mode:
+            MOCK_RESPONSES.inc(endpoint="send_stego_batch")
+            dummy_image = Image.new('RGB', (256, 256), color='gray')
+            ImageDraw.Draw(dummy_image).text((10, 10), "Mock Stego Image\nModels Missing", fill="white", font=ImageFont.load_default())
+            dummy_bytes = pil_to_bytes(dummy_image, compress_level=PNG_COMPRESS_LEVEL)
+            outputs = {i: dummy_bytes for i in covers}
+            model = None
+        else:
+            model = model_registry.active
+            for secret_hash, indices in groups.items():
+                with STAGE_SECONDS.time(stage="decode"):
+                    secret_tensor = image_to_tensor(io.BytesIO(secret_bytes_by_hash[secret_hash]), MEAN, STD, device=device)
+                prepared = scheduler.run("prepare", model, secret_tensor)
+                # Covers are decoded and resized first so their hide passes reach the scheduler together
+                with STAGE_SECONDS.time(stage="decode"):
+                    cover_tensors = {i: image_to_tensor(covers[i], MEAN, STD, device=device) for i in indices}
+                futures = {i: scheduler.submit("hide_prepared", model, cover_tensor, prepared) for i, cover_tensor in cover_tensors.items()}
+                for i, future in futures.items():
+                    stego = future.result()
+                    with STAGE_SECONDS.time(stage="encode"):
+                        outputs[i] = pil_to_bytes(tensor_to_pil(stego, MEAN, STD), compress_level=PNG_COMPRESS_LEVEL)
+
+        order = sorted(outputs)
+        version = model.version if model else None
+        message_ids = save_messages([(sender, results[i]["receiver"], outputs[i], version) for i in order])
+        for i, message_id in zip(order, message_ids):
+            results[i]["message_id"] = message_id
+            results[i]["stego_image_url"] = f"/api/stego-image/{message_id}"
+    except Exception as e:
+        logger.error(f"Error processing stego batch: {str(e)}")
+        return jsonify({"error": f"Failed to process images: {str(e)}"}), 500
+
+    for result in results:
+        result["status"] = "sent" if "message_id" in result else "failed"
+    sent = sum(1 for result in results if result["status"] == "sent")
+    summary = {
+        "message": f"Sent {sent} of {count} stego images" + (" (mock mode - no models loaded)" if mock_mode else ""),
+        "sent": sent,
+        "failed": count - sent,
+        "results": results,
+    }
+    if mimetype == MULTIPART_MIMETYPE:
+        # The summary part, then each stored PNG in item order, saving a round trip per image
+        return multipart_response(summary, (({"Content-Type": "image/png", "X-Index": i, "X-Message-Id": results[i]["message_id"]}, outputs[i])
+                                            for i in sorted(outputs)))
+    return json_response(summary)
+
+def enqueue_send(sender, receiver, cover_file, secret_file, tiled):
+    # Both uploads have already passed open_upload, so they are known-good before being queued
+    cover_file.stream.seek(0)
+    secret_file.stream.seek(0)
+    cover_bytes = cover_file.read()
+    secret_bytes = secret_file.read()
+    try:
+        job_id = job_queue.submit(sender, receiver, cover_bytes, secret_bytes, tiled=tiled)
+    except QueueFull as e:
+        logger.warning(f"Send queue full, asking client to retry in {e.retry_after}s")
+        response = jsonify({"error": "Server is busy, please retry later"})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    logger.debug(f"Queued send job {job_id}")
+    return jsonify({"message": "Stego image queued", "job_id": job_id, "status_url": f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if job_queue is None:
+        return jsonify({"error": "Asynchronous sending is not enabled"}), 404
+    try:
+        wait = min(float(request.args.get('wait', 0)), ASYNC_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    job = job_queue.status(job_id, wait=max(0.0, wait))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "done":
+        job["stego_image_url"] = f"/api/stego-image/{job['message_id']}"
+    return jsonify(job)
+
+@app.route('/api/job-stats', methods=['GET'])
+def job_stats():
+    if job_queue is None:
+        return jsonify({"enabled": False, "pid": os.getpid()})
+    return jsonify(dict(job_queue.stats(), enabled=True, pid=os.getpid()))
+
 @app.route('/api/received-images/<username>', methods=['GET'])
 def get_received_images(username):
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT id, sender, stego_image FROM messages WHERE receiver=?", (username,))
-    messages = c.fetchall()
-    conn.close()
-    result = [{"id": msg[0], "sender": msg[1], "stego_image": base64.b64encode(msg[2]).decode('utf-8')} for msg in messages]
-    return jsonify(result)
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', INBOX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    limit = max(1, min(limit, INBOX_MAX_PAGE_SIZE))
+    mimetype = negotiate(BATCH_OFFERS)
+    if mimetype is None:
+        return not_acceptable(BATCH_OFFERS)
+    size_column = "image_size" if legacy_image_column == "NULL" else "COALESCE(image_size, LENGTH(stego_image))"
+    # Fetch one extra row to know whether another page exists
+    with STAGE_SECONDS.time(stage="db_read"):
+        messages = db.query(f"SELECT id, sender, {size_column}, created_at, image_hash FROM messages WHERE receiver=? AND id > ? ORDER BY id LIMIT ?",
+                            (username, cursor, limit + 1))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    items = [{"id": msg[0], "sender": msg[1], "size": msg[2], "timestamp": msg[3], "image_url": f"/api/stego-image/{msg[0]}"} for msg in messages]
+    page = {"items": items, "next_cursor": messages[-1][0] if has_more else None}
+    if mimetype == MULTIPART_MIMETYPE:
+        return multipart_response(page, inbox_image_parts(messages))
+    return json_response(page)
+
+def inbox_image_parts(messages):
+    # Stored bytes go out unchanged, read one message at a time while the response streams.
+    # Messages deleted since the page was listed are skipped.
+    for msg_id, _, _, _, image_hash in messages:
+        if image_hash:
+            try:
+                image_bytes = blob_store.read(image_hash)
+            except FileNotFoundError:
+                continue
+        else:
+            row = db.query_one(f"SELECT {legacy_image_column} FROM messages WHERE id=?", (msg_id,))
+            image_bytes = row[0] if row else None
+        if image_bytes is not None:
+            yield {"Content-Type": "image/png", "X-Message-Id": msg_id}, image_bytes
+
+def encode_secret(image, extension):
+    return pil_to_bytes(image, extension.upper(), PNG_COMPRESS_LEVEL if extension == "png" else WEBP_METHOD)
 
 @app.route('/api/extract-secret/<int:msg_id>', methods=['GET'])
 def extract_secret(msg_id):
     if not models_loaded and not mock_mode:
         logger.warning("Steganography models not loaded, returning 503")
         return jsonify({"error": "Steganography models are not loaded. Ensure .pth files are in the backend directory."}), 503
+    mimetype = negotiate(IMAGE_OFFERS)
+    if mimetype is None:
+        return not_acceptable(IMAGE_OFFERS)
+    # JSON carries the PNG in base64; a WebP response is encoded and cached separately
+    extension = "webp" if mimetype == "image/webp" else "png"
 
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT stego_image FROM messages WHERE id=?", (msg_id,))
-    img_blob = c.fetchone()
-    conn.close()
+    with STAGE_SECONDS.time(stage="db_read"):
+        row = db.query_one(f"SELECT image_hash, {legacy_image_column}, model_version FROM messages WHERE id=?", (msg_id,))
 
-    if not img_blob:
+    if not row:
         logger.error(f"Image with ID {msg_id} not found")
         return jsonify({"error": "Image not found"}), 404
 
     try:
         if mock_mode:
-            logger.info("Mock mode: Returning dummy secret image")
+            logger.debug("Mock mode: Returning dummy secret image")
+            MOCK_RESPONSES.inc(endpoint="extract_secret")
             dummy_image = Image.new('RGB', (256, 256), color='blue')
             draw = ImageDraw.Draw(dummy_image)
             try:
@@ -282,78 +721,157 @@ def extract_secret(msg_id):
             except AttributeError:
                 font = ImageFont.load_default()
             draw.text((10, 10), "Mock Secret Image\nModels Missing", fill="white", font=font)
-            image_bytes = pil_to_bytes(dummy_image)
+            image_bytes = encode_secret(dummy_image, extension)
         else:
-            logger.info("Opening stego image from database")
-            image = Image.open(io.BytesIO(img_blob[0])).convert("RGB")
-
-            logger.info("Setting up image transforms for extraction")
-            transform = transforms.Compose([
-                transforms.Resize((256, 256)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=MEAN, std=STD)
-            ])
-
-            logger.info("Transforming stego image to tensor")
-            stego_tensor = transform(image).unsqueeze(0).to(device)
-            logger.info(f"Stego tensor shape for extraction: {stego_tensor.shape}")
-
-            if stego_tensor.shape != (1, 3, 256, 256):
-                logger.error(f"Invalid stego tensor shape: {stego_tensor.shape}")
-                return jsonify({"error": "Stego tensor has invalid shape. Expected (1, 3, 256, 256)"}), 500
-
-            logger.info("Running RevealNetwork to extract secret image")
-            with torch.no_grad():
-                revealed_secret = reveal_net(stego_tensor)
-                logger.info(f"Revealed secret shape: {revealed_secret.shape}")
-                if revealed_secret.shape != (1, 3, 256, 256):
-                    logger.error(f"RevealNetwork output shape mismatch: {revealed_secret.shape}")
-                    return jsonify({"error": "RevealNetwork output shape mismatch. Expected (1, 3, 256, 256)"}), 500
-
-            logger.info("Converting extracted secret to PIL image")
-            revealed_pil = tensor_to_pil(revealed_secret, MEAN, STD)
-            logger.info("Converting extracted secret image to bytes")
-            image_bytes = pil_to_bytes(revealed_pil)
-
-        return jsonify({
-            "secret_image": base64.b64encode(image_bytes).decode('utf-8'),
-            "message": "Secret image extracted" + (" (mock mode - no models loaded)" if mock_mode else "")
-        })
+            try:
+                with STAGE_SECONDS.time(stage="blob_read"):
+                    stego_bytes = read_message_image(row[0], row[1])
+            except FileNotFoundError:
+                # The message was deleted after its row was read
+                return jsonify({"error": "Image not found"}), 404
+            stego_hash = stego_cache_key(row[0], stego_bytes)
+            # Revealed with the weights that hid the message, which may no longer be the active ones
+            model = model_for(row[2])
+            image_bytes = secret_cache.get(stego_hash, model.cache_key, extension)
+            if image_bytes is not None:
+                logger.debug("Serving extracted secret from cache")
+            else:
+                logger.debug("Opening stego image from database")
+                image = Image.open(io.BytesIO(stego_bytes))
+
+                if image.size != (256, 256):
+                    # Anything other than 256x256 was produced in tiled mode
+                    logger.debug(f"Running tiled reveal at {image.size[0]}x{image.size[1]}")
+                    with STAGE_SECONDS.time(stage="decode"):
+                        image.load()
+                    with STAGE_SECONDS.time(stage="tiled_reveal"):
+                        revealed_pil = reveal_tiled(image, partial(reveal_tiles, model), MEAN, STD,
+                                                    overlap=TILE_OVERLAP, batch_size=TILE_BATCH)
+                    logger.debug("Converting extracted secret image to bytes")
+                    with STAGE_SECONDS.time(stage="encode"):
+                        image_bytes = encode_secret(revealed_pil, extension)
+                else:
+                    logger.debug("Transforming stego image to tensor")
+                    with STAGE_SECONDS.time(stage="decode"):
+                        stego_tensor = image_to_tensor(image, MEAN, STD, device=device)
+                    logger.debug(f"Stego tensor shape for extraction: {stego_tensor.shape}")
+
+                    if stego_tensor.shape != (1, 3, 256, 256):
+                        logger.error(f"Invalid stego tensor shape: {stego_tensor.shape}")
+                        return jsonify({"error": "Stego tensor has invalid shape. Expected (1, 3, 256, 256)"}), 500
+
+                    logger.debug("Running RevealNetwork to extract secret image")
+                    revealed_secret = scheduler.run("reveal", model, stego_tensor)
+                    logger.debug(f"Revealed secret shape: {revealed_secret.shape}")
+                    if revealed_secret.shape != (1, 3, 256, 256):
+                        logger.error(f"RevealNetwork output shape mismatch: {revealed_secret.shape}")
+                        return jsonify({"error": "RevealNetwork output shape mismatch. Expected (1, 3, 256, 256)"}), 500
+
+                    logger.debug(f"Converting extracted secret to {extension.upper()} bytes")
+                    with STAGE_SECONDS.time(stage="encode"):
+                        image_bytes = encode_secret(tensor_to_pil(revealed_secret, MEAN, STD), extension)
+                secret_cache.put(stego_hash, model.cache_key, image_bytes, extension)
+
+        message = "Secret image extracted" + (" (mock mode - no models loaded)" if mock_mode else "")
+        if mimetype == JSON_MIMETYPE:
+            return json_response({
+                "secret_image": base64.b64encode(image_bytes).decode('utf-8'),
+                "message": message
+            })
+        return image_response(image_bytes, mimetype, {"X-StegoNet-Message": message})
     except Exception as e:
         logger.error(f"Error extracting secret image: {str(e)}")
         return jsonify({"error": f"Failed to extract secret: {str(e)}"}), 500
 
+@app.route('/api/stego-image/<int:msg_id>', methods=['GET'])
+def get_stego_image(msg_id):
+    with STAGE_SECONDS.time(stage="db_read"):
+        row = db.query_one(f"SELECT image_hash, created_at, {legacy_image_column} FROM messages WHERE id=?", (msg_id,))
+
+    if not row:
+        return jsonify({"error": "Image not found"}), 404
+    image_hash, created_at, legacy_image = row
+    try:
+        if image_hash:
+            # Content-addressed, so the hash is a strong ETag
+            etag = image_hash
+            path = blob_store.path(image_hash)
+            source = path if path else io.BytesIO(blob_store.read(image_hash))
+        else:
+            etag = hashlib.sha256(legacy_image).hexdigest()
+            source = io.BytesIO(legacy_image)
+        response = send_file(source, mimetype="image/png", etag=etag, last_modified=created_at, conditional=True)
+    except FileNotFoundError:
+        # The message was deleted after its row was read
+        return jsonify({"error": "Image not found"}), 404
+    # Message ids can be reused after deletion, so browsers revalidate instead of caching blindly
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/api/delete-image/<int:msg_id>', methods=['DELETE'])
 def delete_image(msg_id):
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE id=?", (msg_id,))
-    c.execute("DELETE FROM SQLITE_SEQUENCE WHERE name='messages'")
-    conn.commit()
-    conn.close()
+    with db.transaction(immediate=True) as c:
+        c.execute(f"SELECT image_hash, {legacy_image_column} FROM messages WHERE id=?", (msg_id,))
+        rows = c.fetchall()
+        c.execute("DELETE FROM messages WHERE id=?", (msg_id,))
+        c.execute("DELETE FROM SQLITE_SEQUENCE WHERE name='messages'")
+        delete_message_images(c, rows)
     logger.info(f"Image with ID {msg_id} deleted")
     return jsonify({"message": "Image deleted successfully"}), 200
 
 @app.route('/api/remove-user/<username>', methods=['DELETE'])
 def remove_user(username):
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE username=?", (username,))
-    c.execute("DELETE FROM messages WHERE sender=? OR receiver=?", (username, username))
-    conn.commit()
-    conn.close()
+    with db.transaction(immediate=True) as c:
+        c.execute("DELETE FROM users WHERE username=?", (username,))
+        c.execute(f"SELECT image_hash, {legacy_image_column} FROM messages WHERE sender=? OR receiver=?", (username, username))
+        rows = c.fetchall()
+        c.execute("DELETE FROM messages WHERE sender=? OR receiver=?", (username, username))
+        delete_message_images(c, rows)
     logger.info(f"User {username} removed")
     return jsonify({"message": f"User {username} removed"}), 200
 
 @app.route('/api/all-messages', methods=['GET'])
 def get_all_messages():
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("SELECT id, sender, receiver FROM messages")
-    messages = c.fetchall()
-    conn.close()
+    messages = db.query("SELECT id, sender, receiver FROM messages")
     result = [{"id": msg[0], "sender": msg[1], "receiver": msg[2]} for msg in messages]
     return jsonify(result)
 
+@app.route('/api/secret-cache-stats', methods=['GET'])
+def secret_cache_stats():
+    return jsonify(dict(secret_cache.stats(), pid=os.getpid()))
+
+@app.route('/api/scheduler-stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(dict(scheduler.stats(), pid=os.getpid()))
+
+@app.route('/api/models', methods=['GET'])
+def model_versions():
+    return jsonify(model_registry.versions())
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok", "pid": os.getpid()}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: models loaded and warmed up, database reachable. Mock mode is not ready.
+    models = "ready" if models_loaded else "mock" if mock_mode else "loading"
+    try:
+        db.query_one("SELECT 1")
+        database = "ok"
+    except Exception as e:
+        database = f"error: {str(e)}"
+    ready = models == "ready" and database == "ok"
+    active = model_registry.active
+    return jsonify({"ready": ready, "models": models, "model_version": active.version if active else None,
+                    "precision": active.precision if active else None, "database": database}), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Each worker process keeps its own metrics; the pid label tells their scrapes apart
+    return app.response_class(metrics.REGISTRY.render({"pid": os.getpid()}), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
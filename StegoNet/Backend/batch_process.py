@@ -0,0 +1,315 @@
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+
+import numpy as np
+import torch
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from generate_dummy_models import MODEL_FILENAMES
+from preprocess import MEAN, STD, IMAGE_SIZE, decode_image, uint8_to_tensor, tensor_to_uint8
+from pipeline import load_networks, hide_image, reveal_image
+from precision import PRECISIONS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+INPUT_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+# Work items are (output path, source paths). For hide the sources are (cover,) with a shared
+# secret or (cover, secret); for reveal they are (stego,).
+
+def list_directory(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(INPUT_EXTENSIONS))
+    return paths
+
+
+def read_manifest(path, columns):
+    # CSV or plain text, one item per line: `columns` source paths, then an optional output name.
+    # Relative paths are resolved against the manifest's directory; `#` starts a comment line.
+    base = os.path.dirname(os.path.abspath(path))
+    rows = []
+    with open(path, newline="") as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            row = [field.strip() for field in row]
+            if not row or not row[0] or row[0].startswith("#"):
+                continue
+            if len(row) < columns:
+                raise ValueError(f"{path}:{line_number}: expected {columns} source path(s), got {len(row)}")
+            sources = tuple(os.path.join(base, field) for field in row[:columns])
+            rows.append((sources, row[columns] if len(row) > columns and row[columns] else None))
+    return rows
+
+
+def plan_items(inputs, output_dir, secrets=None):
+    # inputs/secrets: a directory or a manifest. Directory outputs mirror the input tree; manifest
+    # outputs default to the input's base name. Every output is written as PNG.
+    columns = 2 if secrets == "manifest" else 1
+    if columns == 2 and os.path.isdir(inputs):
+        raise ValueError("--secrets manifest needs the inputs to be a manifest with a secret column")
+    if os.path.isdir(inputs):
+        paths = list_directory(inputs)
+        rows = [((path,), os.path.relpath(path, inputs)) for path in paths]
+    else:
+        rows = [(sources, name or os.path.basename(sources[0])) for sources, name in read_manifest(inputs, columns)]
+    if secrets and secrets != "manifest":
+        secret_paths = list_directory(secrets) if os.path.isdir(secrets) else [sources[0] for sources, _ in read_manifest(secrets, 1)]
+        if len(secret_paths) != len(rows):
+            raise ValueError(f"{len(rows)} inputs but {len(secret_paths)} secrets; they are paired in sorted order")
+        rows = [(sources + (secret,), name) for (sources, name), secret in zip(rows, secret_paths)]
+    items, seen = [], set()
+    for sources, name in rows:
+        output = os.path.join(output_dir, os.path.splitext(name)[0] + ".png")
+        if output in seen:
+            raise ValueError(f"Two inputs map to the same output {output}; give explicit output names in a manifest")
+        seen.add(output)
+        items.append((output, sources))
+    return items
+
+
+# Decode/encode worker processes. They only use PIL and numpy; torch stays in the parent.
+
+def decode_chunk(items, size):
+    # Returns (output, arrays, error) per item, with every source decoded to size x size RGB
+    # uint8, or at full resolution when size is None (tiled hide, and reveal, where input that
+    # is not 256x256 was produced in tiled mode)
+    decoded = []
+    for output, sources in items:
+        try:
+            arrays = []
+            for source in sources:
+                with Image.open(source) as image:
+                    arrays.append(np.asarray(decode_image(image, size)))
+            decoded.append((output, arrays, None))
+        except Exception as e:
+            decoded.append((output, None, f"{sources[0]}: {str(e)}"))
+    return decoded
+
+
+def encode_chunk(outputs, compress_level):
+    # Writes each array as PNG through a temporary file, so an interrupted run never leaves a
+    # truncated output that a resumed run would mistake for a finished one
+    errors = []
+    for path, array in outputs:
+        temp_path = path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            Image.fromarray(array).save(temp_path, format="PNG", compress_level=compress_level)
+            os.replace(temp_path, path)
+        except Exception as e:
+            errors.append(f"{path}: {str(e)}")
+    return len(outputs) - len(errors), errors
+
+
+class BatchRunner:
+    # Inference in this process; decoding and encoding in a process pool. Up to `prefetch`
+    # decoded chunks wait ahead of the networks and up to `prefetch` encoded ones behind them,
+    # so reading, compute and writing overlap without unbounded memory.
+    def __init__(self, mode, networks, pool, device, batch_size=16, prefetch=4, compress_level=6,
+                 secret=None, tiled=False, overlap=32, tile_batch=8, mean=MEAN, std=STD):
+        self.mode = mode
+        self.prep_net, self.hide_net, self.reveal_net = networks
+        self.pool = pool
+        self.device = device
+        self.batch_size = batch_size
+        self.prefetch = max(1, prefetch)
+        self.compress_level = compress_level
+        self.tiled = tiled
+        self.overlap = overlap
+        self.tile_batch = tile_batch
+        self.mean, self.std = mean, std
+        # `secret` is an opened, not yet decoded shared secret, decoded the way the server does:
+        # at full resolution for tiled hiding, otherwise straight to IMAGE_SIZE with JPEG draft mode
+        self.secret = None
+        self.prepared_secret = None
+        if mode == "hide" and secret is not None and tiled:
+            self.secret = decode_image(secret, None).copy()
+        elif mode == "hide" and secret is not None:
+            # A shared secret goes through PreparationNetwork once for the whole run
+            with torch.no_grad():
+                self.prepared_secret = self.prep_net(uint8_to_tensor(np.asarray(decode_image(secret)), mean, std).to(device))
+        self.counts = {"done": 0, "failed": 0}
+        self.seconds = {"decode_wait": 0.0, "inference": 0.0, "write_wait": 0.0}
+        self.failures = []
+
+    def _infer(self, batch):
+        # batch: list of input arrays per item, all IMAGE_SIZE x IMAGE_SIZE
+        with torch.no_grad():
+            first = uint8_to_tensor(np.stack([arrays[0] for arrays in batch]), self.mean, self.std).to(self.device)
+            if self.mode == "reveal":
+                result = self.reveal_net(first)
+            else:
+                if self.prepared_secret is not None:
+                    prepared = self.prepared_secret.expand(len(batch), -1, -1, -1)
+                else:
+                    secrets = uint8_to_tensor(np.stack([arrays[1] for arrays in batch]), self.mean, self.std).to(self.device)
+                    prepared = self.prep_net(secrets)
+                result = self.hide_net(first, prepared)
+        return list(tensor_to_uint8(result, self.mean, self.std))
+
+    def _infer_tiled(self, arrays):
+        image = Image.fromarray(arrays[0])
+        if self.mode == "reveal":
+            result = reveal_image(image, self.reveal_net, self.mean, self.std, self.device,
+                                  overlap=self.overlap, tile_batch=self.tile_batch)
+        else:
+            secret = self.secret if self.secret is not None else Image.fromarray(arrays[1])
+            result = hide_image(image, secret, self.prep_net, self.hide_net, self.mean, self.std, self.device,
+                                tiled=True, overlap=self.overlap, tile_batch=self.tile_batch)
+        return np.asarray(result)
+
+    def _collect_write(self, pending_writes):
+        started = time.perf_counter()
+        written, errors = pending_writes.popleft().get()
+        self.seconds["write_wait"] += time.perf_counter() - started
+        self.counts["done"] += written
+        self._fail(errors)
+
+    def _fail(self, errors):
+        for error in errors:
+            logger.error(f"Failed: {error}")
+        self.counts["failed"] += len(errors)
+        self.failures.extend(errors)
+
+    def run(self, items, progress_seconds=10.0):
+        chunks = deque(items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size))
+        size = None if self.mode == "reveal" or self.tiled else IMAGE_SIZE
+        pending_decodes, pending_writes = deque(), deque()
+        started = last_report = time.perf_counter()
+        while chunks or pending_decodes:
+            while chunks and len(pending_decodes) < self.prefetch:
+                pending_decodes.append(self.pool.apply_async(decode_chunk, (chunks.popleft(), size)))
+            wait_started = time.perf_counter()
+            decoded = pending_decodes.popleft().get()
+            self.seconds["decode_wait"] += time.perf_counter() - wait_started
+
+            self._fail([error for _, _, error in decoded if error])
+            batch = [(output, arrays) for output, arrays, error in decoded
+                     if not error and arrays[0].shape[:2] == (IMAGE_SIZE, IMAGE_SIZE) and not self.tiled]
+            single = [(output, arrays) for output, arrays, error in decoded
+                      if not error and (arrays[0].shape[:2] != (IMAGE_SIZE, IMAGE_SIZE) or self.tiled)]
+            infer_started = time.perf_counter()
+            outputs = []
+            if batch:
+                outputs.extend(zip([output for output, _ in batch], self._infer([arrays for _, arrays in batch])))
+            outputs.extend((output, self._infer_tiled(arrays)) for output, arrays in single)
+            self.seconds["inference"] += time.perf_counter() - infer_started
+
+            if outputs:
+                pending_writes.append(self.pool.apply_async(encode_chunk, (outputs, self.compress_level)))
+            while len(pending_writes) > self.prefetch:
+                self._collect_write(pending_writes)
+
+            now = time.perf_counter()
+            if now - last_report >= progress_seconds:
+                last_report = now
+                finished = self.counts["done"] + self.counts["failed"]
+                logger.info(f"{finished}/{len(items)} images, {self.counts['done'] / (now - started):.1f} images/s")
+        while pending_writes:
+            self._collect_write(pending_writes)
+        elapsed = time.perf_counter() - started
+        return {
+            "mode": self.mode,
+            "images": self.counts["done"],
+            "failed": self.counts["failed"],
+            "seconds": elapsed,
+            "images_per_s": self.counts["done"] / elapsed if elapsed > 0 else 0.0,
+            "stage_seconds": self.seconds,
+        }
+
+
+def process(mode, inputs, output_dir, secret=None, secrets=None, batch_size=16, workers=None, torch_threads=None,
+            prefetch=4, compress_level=6, tiled=False, overlap=32, tile_batch=8, model_dir=BACKEND_DIR,
+            engine_mode="fused", compile_mode="none", precision="fp32", overwrite=False):
+    cpus = os.cpu_count() or 1
+    workers = workers or max(1, cpus // 4)
+    items = plan_items(inputs, output_dir, secrets)
+    # Finished outputs are skipped, so rerunning the same command resumes an interrupted run
+    pending = items if overwrite else [item for item in items if not os.path.exists(item[0])]
+    skipped = len(items) - len(pending)
+    if skipped:
+        logger.info(f"Skipping {skipped} of {len(items)} images whose output already exists")
+    if not pending:
+        return {"mode": mode, "images": 0, "failed": 0, "skipped": skipped, "seconds": 0.0, "images_per_s": 0.0}
+
+    # The pool is forked before torch starts its thread pools; the workers never use torch
+    pool = multiprocessing.get_context("fork").Pool(workers)
+    try:
+        torch.set_num_threads(torch_threads or max(1, cpus - workers))
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model_files = {name: os.path.join(model_dir, filename) for name, filename in MODEL_FILENAMES.items()}
+        prep_net, hide_net, reveal_net, version, precision = load_networks(model_files, device, engine_mode,
+                                                                           compile_mode, precision)
+        logger.info(f"Loaded model version {version[:12]} ({precision}); {len(pending)} images, "
+                    f"{workers} decode/encode workers, {torch.get_num_threads()} inference threads")
+        secret_image = Image.open(secret) if secret else None
+        runner = BatchRunner(mode, (prep_net, hide_net, reveal_net), pool, device, batch_size=batch_size,
+                             prefetch=prefetch, compress_level=compress_level, secret=secret_image, tiled=tiled,
+                             overlap=overlap, tile_batch=tile_batch)
+        report = runner.run(pending)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    report.update(skipped=skipped, model_version=version, precision=precision, workers=workers,
+                  torch_threads=torch.get_num_threads(), batch_size=batch_size, failures=runner.failures)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hide or reveal whole directories of images offline, without the HTTP server.")
+    parser.add_argument("mode", choices=["hide", "reveal"])
+    parser.add_argument("inputs", help="Directory of images (searched recursively) or CSV manifest. For hide these are the "
+                                       "covers; a manifest may give `cover,secret[,output]` per line with --secrets manifest")
+    parser.add_argument("--output", required=True, help="Output directory; outputs are PNG and mirror the input tree")
+    parser.add_argument("--secret", help="hide: one secret image hidden in every cover")
+    parser.add_argument("--secrets", help="hide: directory or manifest of secrets paired with the covers in sorted order, "
+                                          "or `manifest` when the inputs manifest has a secret column")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None, help="Decode/encode processes (default: a quarter of the cores)")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Inference threads (default: the remaining cores)")
+    parser.add_argument("--prefetch", type=int, default=4, help="Decoded and encoded batches allowed in flight")
+    parser.add_argument("--compress-level", type=int, default=6, help="PNG zlib level 0-9; lower is faster and larger")
+    parser.add_argument("--tiled", action="store_true", help="hide: keep the covers' resolution using overlapping tiles")
+    parser.add_argument("--overlap", type=int, default=32)
+    parser.add_argument("--tile-batch", type=int, default=8)
+    parser.add_argument("--model-dir", default=BACKEND_DIR, help="Directory holding the three .pth files")
+    parser.add_argument("--engine", default="fused", choices=["fused", "reference"])
+    parser.add_argument("--compile", default="none", choices=["none", "script", "compile"])
+    parser.add_argument("--precision", default="fp32", choices=list(PRECISIONS))
+    parser.add_argument("--overwrite", action="store_true", help="Redo images whose output already exists")
+    parser.add_argument("--report", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    if args.mode == "hide" and not (args.secret or args.secrets):
+        parser.error("hide needs --secret or --secrets")
+    if args.mode == "reveal" and (args.secret or args.secrets):
+        parser.error("--secret/--secrets only apply to hide")
+    report = process(args.mode, args.inputs, args.output, secret=args.secret, secrets=args.secrets,
+                     batch_size=args.batch_size, workers=args.workers, torch_threads=args.torch_threads,
+                     prefetch=args.prefetch, compress_level=args.compress_level, tiled=args.tiled,
+                     overlap=args.overlap, tile_batch=args.tile_batch, model_dir=args.model_dir,
+                     engine_mode=args.engine, compile_mode=args.compile, precision=args.precision,
+                     overwrite=args.overwrite)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"{report['images']} images in {report['seconds']:.1f}s ({report['images_per_s']:.1f} images/s), "
+          f"{report['skipped']} skipped, {report['failed']} failed")
+    sys.exit(1 if report["failed"] else 0)
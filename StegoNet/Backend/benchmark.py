@@ -0,0 +1,336 @@
+import io
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from generate_dummy_models import generate_models
+from preprocess import MEAN, STD, image_to_tensor
+from models import tensor_to_pil, pil_to_bytes
+from pipeline import load_networks
+from precision import PRECISIONS
+from blobstore import LocalBlobStore, add_ref
+from db import Database
+
+# Metrics compared against a baseline; lower is better for latencies, higher for throughput
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+THROUGHPUT_KEYS = ("throughput_per_s",)
+
+
+def summarize(samples, items=1):
+    # samples: per-iteration wall times in seconds, each covering `items` images/requests
+    times = np.asarray(samples, dtype=np.float64) * 1000.0
+    total = float(times.sum()) / 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": float(times.mean()),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "throughput_per_s": len(samples) * items / total if total > 0 else 0.0,
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_image(size, fmt, seed=0):
+    # Smooth colour fields plus noise, so PNG/JPEG sizes resemble photos rather than pure noise
+    rng = np.random.RandomState(seed)
+    coarse = Image.fromarray(rng.randint(0, 256, (8, 8, 3), dtype=np.uint8)).resize((size, size), Image.BICUBIC)
+    pixels = np.asarray(coarse, dtype=np.int16) + rng.randint(-12, 13, (size, size, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def timed(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_decode(sizes, formats, iterations, warmup):
+    results = {}
+    for fmt in formats:
+        for size in sizes:
+            data = make_image(size, fmt, seed=size)
+            samples = timed(lambda: image_to_tensor(io.BytesIO(data), MEAN, STD), iterations, warmup)
+            results[f"{fmt.lower()}-{size}"] = dict(summarize(samples), input_bytes=len(data))
+    return results
+
+
+def bench_networks(model_files, batch_sizes, iterations, warmup, engine_mode, compile_mode, precision):
+    device = torch.device("cpu")
+    prep_net, hide_net, reveal_net, _, precision = load_networks(model_files, device, engine_mode, compile_mode, precision)
+    results = {"precision": precision}
+    for batch_size in batch_sizes:
+        cover = torch.cat([image_to_tensor(io.BytesIO(make_image(256, "PNG", seed=i)), MEAN, STD) for i in range(batch_size)])
+        secret = torch.cat([image_to_tensor(io.BytesIO(make_image(256, "PNG", seed=100 + i)), MEAN, STD) for i in range(batch_size)])
+        with torch.no_grad():
+            prepared = prep_net(secret)
+            stego = hide_net(cover, prepared)
+            stages = {
+                "prep_net": lambda: prep_net(secret),
+                "hide_net": lambda: hide_net(cover, prepared),
+                "reveal_net": lambda: reveal_net(stego),
+            }
+            for name, fn in stages.items():
+                results.setdefault(name, {})[f"batch-{batch_size}"] = summarize(timed(fn, iterations, warmup), batch_size)
+        first = stego[:1]
+        results.setdefault("postprocess", {})[f"batch-{batch_size}"] = summarize(
+            timed(lambda: [pil_to_bytes(tensor_to_pil(t, MEAN, STD)) for t in stego.split(1)], iterations, warmup), batch_size)
+    return results, pil_to_bytes(tensor_to_pil(first, MEAN, STD))
+
+
+def bench_database(workdir, image_bytes, iterations, warmup):
+    database = Database(os.path.join(workdir, "bench-stages.db"))
+    database.migrate()
+    store = LocalBlobStore(os.path.join(workdir, "bench-stage-blobs"))
+    counter = iter(range(10 ** 9))
+
+    def insert():
+        # Distinct bytes per row so each insert also writes a new blob
+        payload = image_bytes + next(counter).to_bytes(8, "big")
+        with database.transaction(immediate=True) as c:
+            image_hash = store.put(payload)
+            add_ref(c, image_hash, len(payload))
+            c.execute("INSERT INTO messages (sender, receiver, image_hash, image_size, created_at) VALUES (?, ?, ?, ?, ?)",
+                      ("bench-sender", "bench-receiver", image_hash, len(payload), int(time.time())))
+
+    def select():
+        rows = database.query("SELECT id, sender, image_size, created_at FROM messages WHERE receiver=? AND id > ? ORDER BY id LIMIT ?",
+                              ("bench-receiver", 0, 51))
+        database.query_one("SELECT image_hash FROM messages WHERE id=?", (rows[-1][0],))
+
+    results = {
+        "insert": summarize(timed(insert, iterations, warmup)),
+        "select": summarize(timed(select, iterations, warmup)),
+    }
+    database.close_all()
+    return results
+
+
+def run_concurrent(make_request, total, concurrency):
+    # make_request(client, index) -> response; each thread drives its own test client
+    from app import app
+    local = threading.local()
+    failures = []
+
+    def one(index):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        started = time.perf_counter()
+        response = make_request(client, index)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            failures.append(response.status_code)
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    stats = summarize(samples)
+    stats["throughput_per_s"] = total / wall if wall > 0 else 0.0
+    stats["concurrency"] = concurrency
+    stats["errors"] = len(failures)
+    return stats
+
+
+def bench_http(requests_per_route, concurrency, size, fmt):
+    import app as service
+    sender, receiver = "bench-sender", "bench-receiver"
+    client = service.app.test_client()
+    for username in (sender, receiver):
+        client.post('/api/register', json={"username": username, "password": "bench"})
+    extension = "jpg" if fmt == "JPEG" else fmt.lower()
+    last_id = service.db.query_one("SELECT COALESCE(MAX(id), 0) FROM messages")[0]
+    # Stego images are content-addressed, so every request gets a distinct cover; otherwise
+    # reveals would be served from the secret cache of an earlier request or round
+    covers = [make_image(size, fmt, seed=last_id + i) for i in range(requests_per_route)]
+    secrets = [make_image(size, fmt, seed=10 ** 6 + i) for i in range(8)]
+
+    def send(client, index):
+        return client.post('/api/send-stego', content_type="multipart/form-data", data={
+            "sender": sender, "receiver": receiver, "async": "0",
+            "cover_image": (io.BytesIO(covers[index]), f"cover.{extension}"),
+            "secret_image": (io.BytesIO(secrets[index % len(secrets)]), f"secret.{extension}"),
+        })
+
+    results = {}
+    results["send_stego"] = run_concurrent(send, requests_per_route, concurrency)
+    message_ids = [row[0] for row in service.db.query("SELECT id FROM messages WHERE receiver=? AND id > ? ORDER BY id",
+                                                      (receiver, last_id))]
+    if not message_ids:
+        return results
+    # Each id is extracted once before any repeats, so the leading requests measure uncached reveals
+    results["extract_secret"] = run_concurrent(
+        lambda client, index: client.get(f'/api/extract-secret/{message_ids[index % len(message_ids)]}'),
+        requests_per_route, concurrency)
+    results["received_images"] = run_concurrent(
+        lambda client, index: client.get(f'/api/received-images/{receiver}'), requests_per_route, concurrency)
+    results["stego_image"] = run_concurrent(
+        lambda client, index: client.get(f'/api/stego-image/{message_ids[index % len(message_ids)]}'),
+        requests_per_route, concurrency)
+    return results
+
+
+def flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    # A latency more than `tolerance` above the baseline, or a throughput more than
+    # `tolerance` below it, is a regression. Metrics missing from either side are skipped.
+    current, previous = flatten(report["results"]), flatten(baseline["results"])
+    regressions = []
+    for path, value in sorted(current.items()):
+        old = previous.get(path)
+        metric = path.rsplit(".", 1)[-1]
+        if old is None or old <= 0:
+            continue
+        if metric in LATENCY_KEYS and value > old * (1 + tolerance):
+            regressions.append({"metric": path, "baseline": old, "current": value, "change": value / old - 1})
+        elif metric in THROUGHPUT_KEYS and value < old * (1 - tolerance):
+            regressions.append({"metric": path, "baseline": old, "current": value, "change": value / old - 1})
+    return regressions
+
+
+def run(args, workdir):
+    model_files = generate_models(workdir, seed=args.seed)
+    torch.manual_seed(args.seed)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "engine": args.engine,
+            "precision": args.precision,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    results = report["results"]
+    results["decode"] = bench_decode(args.sizes, args.formats, args.iterations, args.warmup)
+    network_results, stego_bytes = bench_networks(model_files, args.batch_sizes, args.iterations, args.warmup,
+                                                  args.engine, args.compile, args.precision)
+    # Records the precision actually used, which is fp32 if the requested one was refused
+    report["environment"]["precision"] = network_results.pop("precision")
+    results.update(network_results)
+    results["database"] = bench_database(workdir, stego_bytes, args.iterations, args.warmup)
+    if args.http_requests > 0:
+        results["http"] = {}
+        for concurrency in args.concurrency:
+            results["http"][f"concurrency-{concurrency}"] = bench_http(args.http_requests, concurrency,
+                                                                      args.http_size, args.http_format)
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def configure_service(workdir, engine, compile_mode, precision):
+    # app.py reads its configuration from the environment and resolves model files
+    # relative to the working directory, so both must be set before it is imported. Storage is
+    # always redirected into workdir, whatever the shell has set, so a run on a deployed host
+    # never writes to the real database, blob store or model archive.
+    os.environ["STEGONET_DB"] = os.path.join(workdir, "bench.db")
+    os.environ["STEGONET_BLOB_DIR"] = os.path.join(workdir, "blobs")
+    os.environ["STEGONET_MODEL_DIR"] = os.path.join(workdir, "model_versions")
+    os.environ["STEGONET_ASYNC_SPOOL_DIR"] = os.path.join(workdir, "job_spool")
+    os.environ["STEGONET_ASYNC_SEND"] = "0"
+    os.environ["STEGONET_MODEL_POLL_SECONDS"] = "0"
+    # Default in-memory secret cache only, and no profiler, so results compare across hosts
+    for name in ("STEGONET_SECRET_CACHE_DIR", "STEGONET_SECRET_CACHE_MAX_BYTES", "STEGONET_SECRET_CACHE_MAX_ENTRIES",
+                 "STEGONET_SECRET_CACHE_DISK_MAX_BYTES", "STEGONET_PROFILE_SLOW_MS"):
+        os.environ.pop(name, None)
+    os.environ["STEGONET_ENGINE"] = engine
+    os.environ["STEGONET_ENGINE_COMPILE"] = compile_mode
+    os.environ["STEGONET_PRECISION"] = precision
+    os.chdir(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the StegoNet pipeline stage by stage and through the HTTP routes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 2048], help="Input edge lengths for the decode stage")
+    parser.add_argument("--formats", nargs="+", default=["PNG", "JPEG"], type=str.upper)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--engine", default="fused", choices=["fused", "reference"])
+    parser.add_argument("--compile", default="none", choices=["none", "script", "compile"])
+    parser.add_argument("--precision", default="fp32", choices=list(PRECISIONS))
+    parser.add_argument("--http-requests", type=int, default=32, help="Requests per route; 0 skips the HTTP benchmark")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--http-size", type=int, default=256)
+    parser.add_argument("--http-format", default="PNG", type=str.upper)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Compare against this earlier report and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before a metric is flagged")
+    parser.add_argument("--save-baseline", help="Also write the report to this path for later comparisons")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+    save_baseline = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    with tempfile.TemporaryDirectory(prefix="stegonet-bench-") as workdir:
+        configure_service(workdir, args.engine, args.compile, args.precision)
+        report = run(args, workdir)
+        os.chdir(BACKEND_DIR)
+
+    if baseline is not None:
+        report["regressions"] = compare(report, baseline, args.tolerance)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if save_baseline:
+        with open(save_baseline, "w") as f:
+            f.write(text + "\n")
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.3f} -> {regression['current']:.3f} "
+                  f"({regression['change']:+.1%})", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,113 @@
+import os
+import mmap
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    # Content-addressed storage for image bytes; blobs are identified by their SHA-256 hex digest
+    def put(self, data):
+        raise NotImplementedError
+
+    def read(self, digest):
+        raise NotImplementedError
+
+    def path(self, digest):
+        # Local filesystem path for zero-copy serving, or None if the backend has none
+        return None
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest):
+        if len(digest) != 64 or any(ch not in "0123456789abcdef" for ch in digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        target = self.path(digest)
+        if os.path.exists(target):
+            return digest
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+BLOB_STORES = {
+    "local": LocalBlobStore,
+}
+
+
+def open_blob_store(kind="local", root="blobs"):
+    if kind not in BLOB_STORES:
+        raise ValueError(f"Unknown blob store '{kind}'. Expected one of {sorted(BLOB_STORES)}")
+    return BLOB_STORES[kind](root)
+
+
+def init_blob_schema(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER,
+                    refcount INTEGER NOT NULL DEFAULT 0)''')
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(messages)")}
+    for name, declaration in (("image_hash", "TEXT"), ("image_size", "INTEGER"), ("created_at", "INTEGER")):
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE messages ADD COLUMN {name} {declaration}")
+    return "stego_image" in columns
+
+
+def add_ref(cursor, digest, size):
+    cursor.execute('''INSERT INTO blobs (hash, size, refcount) VALUES (?, ?, 1)
+                      ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1''', (digest, size))
+
+
+def release_refs(cursor, digests):
+    # Returns the digests whose last reference was dropped; the caller deletes their blobs
+    released = []
+    for digest in digests:
+        if not digest:
+            continue
+        cursor.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash=?", (digest,))
+        cursor.execute("SELECT refcount FROM blobs WHERE hash=?", (digest,))
+        row = cursor.fetchone()
+        if row is not None and row[0] <= 0:
+            cursor.execute("DELETE FROM blobs WHERE hash=?", (digest,))
+            released.append(digest)
+    return released
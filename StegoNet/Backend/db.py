@@ -0,0 +1,169 @@
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from blobstore import init_blob_schema
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-16000",
+    "mmap_size=268435456",
+    "foreign_keys=ON",
+)
+
+
+def _initial_schema(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE,
+                    password TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT,
+                    receiver TEXT,
+                    image_hash TEXT,
+                    image_size INTEGER,
+                    created_at INTEGER)''')
+    init_blob_schema(c)
+
+
+def _message_indexes(c):
+    # (receiver, id) serves both the inbox filter and its cursor ordering
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages (receiver, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender)")
+
+
+def _job_queue(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    sender TEXT,
+                    receiver TEXT,
+                    tiled INTEGER NOT NULL DEFAULT 0,
+                    owner_pid INTEGER,
+                    message_id INTEGER,
+                    error TEXT,
+                    created_at REAL,
+                    updated_at REAL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+
+def _model_versions(c):
+    # Weight sets known to the model registry, and the one that produced each message
+    # (NULL for messages sent before versions were recorded)
+    c.execute('''CREATE TABLE IF NOT EXISTS model_versions (
+                    version TEXT PRIMARY KEY,
+                    created_at REAL,
+                    activated_at REAL)''')
+    c.execute("ALTER TABLE messages ADD COLUMN model_version TEXT")
+
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _initial_schema,
+    _message_indexes,
+    _job_queue,
+    _model_versions,
+]
+
+
+class Database:
+    def __init__(self, path, pool_size=8, timeout=5.0):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+        self.local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        for pragma in PRAGMAS:
+            conn.execute(f"PRAGMA {pragma}")
+        return conn
+
+    def _checkout(self):
+        if self.pid != os.getpid():
+            # Connections must not be shared across fork; the child starts with an empty pool
+            self._reset()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _checkin(self, conn):
+        if self.pid != os.getpid():
+            return
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        if self.idle.qsize() < self.pool_size:
+            self.idle.put_nowait(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        # A thread keeps the same connection for nested use until its outermost block exits
+        held = getattr(self.local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._checkout()
+        self.local.conn = conn
+        try:
+            yield conn
+        finally:
+            self.local.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        # immediate=True takes the write lock up front, for read-modify-write sequences
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn.cursor()
+                return
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def columns(self, table):
+        return {row[1] for row in self.query(f"PRAGMA table_info({table})")}
+
+    def migrate(self):
+        with self.transaction(immediate=True) as c:
+            version = c.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logger.info(f"Applying database migration {number}: {migration.__name__}")
+                migration(c)
+                c.execute(f"PRAGMA user_version={number}")
+        return len(MIGRATIONS)
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,180 @@
+import copy
+import logging
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+COMPILE_MODES = {"none", "script", "compile"}
+
+
+def _stack_convs(convs, groups=1):
+    # Build one conv whose output channels are the concatenated outputs of `convs`
+    first = convs[0]
+    in_channels = first.in_channels * groups
+    out_channels = sum(conv.out_channels for conv in convs)
+    fused = nn.Conv2d(in_channels, out_channels, kernel_size=first.kernel_size,
+                      padding=first.padding, groups=groups)
+    with torch.no_grad():
+        fused.weight.copy_(torch.cat([conv.weight for conv in convs], dim=0))
+        fused.bias.copy_(torch.cat([conv.bias for conv in convs], dim=0))
+    return fused
+
+
+class FusedPreparationNetwork(nn.Module):
+    def __init__(self, reference):
+        super(FusedPreparationNetwork, self).__init__()
+        # The three branches read the same input, so their first layers become one 3->65 conv
+        self.conv1 = _stack_convs([reference.branch1_conv1, reference.branch2_conv1, reference.branch3_conv1])
+        self.branch1_conv2 = reference.branch1_conv2
+        self.branch2_conv2 = reference.branch2_conv2
+        self.branch3_conv2 = reference.branch3_conv2
+        self.split1 = reference.branch1_conv1.out_channels
+        self.split2 = self.split1 + reference.branch2_conv1.out_channels
+        self.relu = nn.ReLU(inplace=True)
+
+    def forward(self, x):
+        x = self.relu(self.conv1(x))
+        b1 = self.relu(self.branch1_conv2(x[:, :self.split1]))
+        b2 = self.relu(self.branch2_conv2(x[:, self.split1:self.split2]))
+        b3 = self.relu(self.branch3_conv2(x[:, self.split2:]))
+        return torch.cat((b1, b2, b3), dim=1)
+
+
+class FusedBranches(nn.Module):
+    # Shared trunk of HidingNetwork and RevealNetwork after their input conv
+    def __init__(self, reference):
+        super(FusedBranches, self).__init__()
+        branches = [reference.branch1_convs, reference.branch2_convs, reference.branch3_convs]
+        self.width = branches[0][0].out_channels
+        # All three branches start from the same tensor: one 50->150 conv
+        self.entry = _stack_convs([branch[0] for branch in branches])
+        # Their second layers run side by side on disjoint channels: one grouped conv
+        self.parallel = _stack_convs([branch[1] for branch in branches], groups=3)
+        # Only branch 1 is deeper than two layers
+        self.tail = nn.ModuleList([conv for conv in reference.branch1_convs[2:]])
+        self.final_conv = reference.final_conv
+        self.relu = nn.ReLU(inplace=True)
+
+    def forward(self, x):
+        x = self.relu(self.entry(x))
+        x = self.relu(self.parallel(x))
+        b1 = x[:, :self.width]
+        for conv_layer in self.tail:
+            b1 = self.relu(conv_layer(b1))
+        combined = torch.cat((b1, x[:, self.width:]), dim=1)
+        return self.final_conv(combined)
+
+
+class FusedHidingNetwork(nn.Module):
+    def __init__(self, reference):
+        super(FusedHidingNetwork, self).__init__()
+        self.input_conv = reference.input_conv
+        self.branches = FusedBranches(reference)
+        self.relu = nn.ReLU(inplace=True)
+
+    def forward(self, cover, secret):
+        x = torch.cat((cover, secret), dim=1)
+        return self.branches(self.relu(self.input_conv(x)))
+
+
+class FusedRevealNetwork(nn.Module):
+    def __init__(self, reference):
+        super(FusedRevealNetwork, self).__init__()
+        self.initial_conv = reference.initial_conv
+        self.branches = FusedBranches(reference)
+        self.relu = nn.ReLU(inplace=True)
+
+    def forward(self, x):
+        return self.branches(self.relu(self.initial_conv(x)))
+
+
+class OptimizedNetwork(nn.Module):
+    # Runs a fused module under inference_mode with channels_last inputs
+    def __init__(self, module, channels_last=True):
+        super(OptimizedNetwork, self).__init__()
+        self.module = module
+        self.channels_last = channels_last
+
+    def forward(self, *inputs):
+        with torch.inference_mode():
+            if self.channels_last:
+                inputs = tuple(t.contiguous(memory_format=torch.channels_last) for t in inputs)
+            return self.module(*inputs)
+
+
+def _compile(module, example_inputs, compile_mode, name):
+    if compile_mode == "script":
+        try:
+            with torch.no_grad():
+                scripted = torch.jit.trace(module, example_inputs)
+            return torch.jit.freeze(scripted.eval())
+        except Exception as e:
+            logger.warning(f"TorchScript compilation of {name} failed, running it eagerly: {str(e)}")
+    elif compile_mode == "compile":
+        try:
+            compiled = torch.compile(module)
+            with torch.no_grad():
+                compiled(*example_inputs)
+            return compiled
+        except Exception as e:
+            logger.warning(f"torch.compile of {name} failed, running it eagerly: {str(e)}")
+    return module
+
+
+def build_engine(prep_net, hide_net, reveal_net, device, channels_last=True, compile_mode="none", image_size=256):
+    if compile_mode not in COMPILE_MODES:
+        raise ValueError(f"Unknown compile mode '{compile_mode}'. Expected one of {sorted(COMPILE_MODES)}")
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    fused = (
+        FusedPreparationNetwork(prep_net),
+        FusedHidingNetwork(hide_net),
+        FusedRevealNetwork(reveal_net),
+    )
+    # Fresh copies so the reference modules keep their own layout and parameters
+    fused = tuple(
+        _detach_copy(module).to(device=device, memory_format=memory_format).eval()
+        for module in fused
+    )
+    image = torch.zeros(1, 3, image_size, image_size, device=device).contiguous(memory_format=memory_format)
+    prepared = torch.zeros(1, 65, image_size, image_size, device=device).contiguous(memory_format=memory_format)
+    prep, hide, reveal = fused
+    prep = _compile(prep, (image,), compile_mode, "PreparationNetwork")
+    hide = _compile(hide, (image, prepared), compile_mode, "HidingNetwork")
+    reveal = _compile(reveal, (image,), compile_mode, "RevealNetwork")
+    return (
+        OptimizedNetwork(prep, channels_last),
+        OptimizedNetwork(hide, channels_last),
+        OptimizedNetwork(reveal, channels_last),
+    )
+
+
+def _detach_copy(module):
+    copied = copy.deepcopy(module)
+    for param in copied.parameters():
+        param.requires_grad_(False)
+    return copied
+
+
+def verify_equivalence(reference, optimized, device, batch_size=2, image_size=64, rtol=1e-3, atol=1e-4, seed=0):
+    # Returns the largest absolute difference per network; raises if any exceeds tolerance
+    ref_prep, ref_hide, ref_reveal = reference
+    opt_prep, opt_hide, opt_reveal = optimized
+    generator = torch.Generator().manual_seed(seed)
+    cover = torch.randn(batch_size, 3, image_size, image_size, generator=generator).to(device)
+    secret = torch.randn(batch_size, 3, image_size, image_size, generator=generator).to(device)
+    with torch.no_grad():
+        pairs = {}
+        ref_prepared = ref_prep(secret)
+        pairs["PreparationNetwork"] = (ref_prepared, opt_prep(secret))
+        ref_stego = ref_hide(cover, ref_prepared)
+        pairs["HidingNetwork"] = (ref_stego, opt_hide(cover, ref_prepared))
+        pairs["RevealNetwork"] = (ref_reveal(ref_stego), opt_reveal(ref_stego))
+    errors = {}
+    for name, (expected, actual) in pairs.items():
+        if expected.shape != actual.shape:
+            raise RuntimeError(f"Optimized {name} output shape {tuple(actual.shape)} != reference {tuple(expected.shape)}")
+        errors[name] = (expected - actual).abs().max().item()
+        if not torch.allclose(expected, actual.contiguous(), rtol=rtol, atol=atol):
+            raise RuntimeError(f"Optimized {name} diverges from reference (max abs diff {errors[name]:.3g})")
+    return errors
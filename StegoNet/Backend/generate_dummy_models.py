@@ -1,11 +1,13 @@
+import os
 import torch
 import torch.nn as nn
 from models import PreparationNetwork, HidingNetwork, RevealNetwork
 
-device = torch.device("cpu")
-prep_net = PreparationNetwork().to(device)
-hide_net = HidingNetwork().to(device)
-reveal_net = RevealNetwork().to(device)
+MODEL_FILENAMES = {
+    "prep_net": "preparation_network.pth",
+    "hide_net": "hiding_network.pth",
+    "reveal_net": "reveal_network.pth",
+}
 
 # Initialize weights to produce more varied outputs
 def init_weights(m):
@@ -14,11 +16,27 @@ def init_weights(m):
         if m.bias is not None:
             nn.init.constant_(m.bias, 0)
 
-prep_net.apply(init_weights)
-hide_net.apply(init_weights)
-reveal_net.apply(init_weights)
+def generate_models(output_dir=".", seed=None):
+    # A fixed seed gives byte-identical weights across runs, e.g. for benchmarks
+    if seed is not None:
+        torch.manual_seed(seed)
+    device = torch.device("cpu")
+    networks = {
+        "prep_net": PreparationNetwork().to(device),
+        "hide_net": HidingNetwork().to(device),
+        "reveal_net": RevealNetwork().to(device),
+    }
+    paths = {}
+    for name, net in networks.items():
+        net.apply(init_weights)
+        paths[name] = os.path.join(output_dir, MODEL_FILENAMES[name])
+        # Written beside the target and renamed, so a running server never reads a
+        # half-written file
+        temp_path = paths[name] + ".tmp"
+        torch.save(net.state_dict(), temp_path)
+        os.replace(temp_path, paths[name])
+    return paths
 
-torch.save(prep_net.state_dict(), "preparation_network.pth")
-torch.save(hide_net.state_dict(), "hiding_network.pth")
-torch.save(reveal_net.state_dict(), "reveal_network.pth")
-print("Dummy models generated with initialized weights.")
\ No newline at end of file
+if __name__ == '__main__':
+    generate_models()
+    print("Dummy models generated with initialized weights.")
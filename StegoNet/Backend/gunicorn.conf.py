@@ -0,0 +1,32 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master (preload_app), so the networks are loaded, verified and
+# warmed up a single time and every forked worker shares those pages copy-on-write instead of
+# holding its own copy. Background threads (job dispatcher, batch scheduler) start per worker.
+# Metrics and the /api/*-stats endpoints are per worker too, labelled with the worker's pid.
+import gc
+import os
+
+os.environ.setdefault("STEGONET_PRELOAD", "1")
+
+bind = os.environ.get("STEGONET_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("STEGONET_WORKERS", 2))
+# Requests block on batched inference, so a few threads per worker let the scheduler form batches
+threads = int(os.environ.get("STEGONET_WORKER_THREADS", 8))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.environ.get("STEGONET_WORKER_TIMEOUT", 120))
+
+
+def pre_fork(server, worker):
+    # Objects that exist now are never touched by the collector again, so the refcount/GC
+    # header writes that would otherwise un-share copy-on-write pages stay out of them
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import torch
+    import app as service
+    torch_threads = os.environ.get("STEGONET_TORCH_THREADS")
+    torch.set_num_threads(int(torch_threads) if torch_threads else max(1, (os.cpu_count() or 1) // workers))
+    service.start_background_services()
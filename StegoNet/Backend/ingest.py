@@ -0,0 +1,56 @@
+import os
+import io
+from PIL import Image
+from preprocess import IMAGE_SIZE
+
+# Magic numbers of the accepted upload formats, checked before any decoder sees the bytes
+MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"\xff\xd8\xff", "JPEG"),
+)
+SUPPORTED_FORMATS = tuple(fmt for _, fmt in MAGIC_NUMBERS)
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status=400):
+        super(UploadRejected, self).__init__(message)
+        self.status = status
+
+
+def sniff_format(head):
+    for magic, fmt in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def open_upload(upload, max_bytes, max_pixels, min_size=IMAGE_SIZE, name="image"):
+    # Validates an upload from its size, magic bytes and header dimensions only; nothing is
+    # decoded here. `upload` is a werkzeug FileStorage, a binary file object or bytes.
+    # Returns the lazily-decoding PIL image, or raises UploadRejected.
+    if isinstance(upload, (bytes, bytearray)):
+        stream = io.BytesIO(upload)
+    else:
+        stream = getattr(upload, "stream", upload)
+    stream.seek(0, os.SEEK_END)
+    length = stream.tell()
+    stream.seek(0)
+    if length > max_bytes:
+        raise UploadRejected(f"{name} is larger than {max_bytes} bytes", 413)
+    fmt = sniff_format(stream.read(8))
+    stream.seek(0)
+    if fmt is None:
+        raise UploadRejected(f"{name} is not a supported image. Supported formats are {list(SUPPORTED_FORMATS)}")
+    try:
+        # Restricting the plugin to the sniffed format keeps PIL from probing other decoders
+        image = Image.open(stream, formats=[fmt])
+    except Image.DecompressionBombError:
+        raise UploadRejected(f"{name} has too many pixels", 413)
+    except (OSError, SyntaxError, ValueError):
+        raise UploadRejected(f"{name} is not a valid {fmt} image")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise UploadRejected(f"{name} is {width}x{height}; images must be at most {max_pixels} pixels", 413)
+    if width < min_size or height < min_size:
+        raise UploadRejected(f"Images must be at least {min_size}x{min_size} pixels")
+    return image
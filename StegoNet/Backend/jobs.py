@@ -0,0 +1,285 @@
+import os
+import math
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"done", "failed"}
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super(QueueFull, self).__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+# Worker process side. Each process loads its own copy of the networks once in the initializer.
+_worker = {}
+
+
+def _worker_init(model_files, mean, std, engine_mode, compile_mode, precision, precision_options, torch_threads,
+                 overlap, tile_batch, compress_level):
+    import torch
+    from pipeline import load_networks
+    torch.set_num_threads(torch_threads)
+    device = torch.device("cpu")
+    prep_net, hide_net, _, version, _ = load_networks(model_files, device, engine_mode, compile_mode, precision,
+                                                      **(precision_options or {}))
+    _worker.update(prep_net=prep_net, hide_net=hide_net, version=version, mean=mean, std=std, device=device,
+                   overlap=overlap, tile_batch=tile_batch, compress_level=compress_level)
+
+
+def _run_hide_job(cover_path, secret_path, tiled):
+    from PIL import Image
+    from models import pil_to_bytes
+    from pipeline import hide_image
+    cover_image = Image.open(cover_path)
+    secret_image = Image.open(secret_path)
+    stego = hide_image(cover_image, secret_image, _worker["prep_net"], _worker["hide_net"],
+                       _worker["mean"], _worker["std"], _worker["device"], tiled=tiled,
+                       overlap=_worker["overlap"], tile_batch=_worker["tile_batch"])
+    return pil_to_bytes(stego, compress_level=_worker["compress_level"]), _worker["version"]
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    # Bounded send-stego job queue persisted in the jobs table. Uploads are spooled to disk,
+    # a dispatcher thread claims queued jobs and a process pool runs the inference.
+    def __init__(self, db, spool_dir, on_complete, model_files, mean, std, workers=2, max_pending=32,
+                 engine_mode="fused", compile_mode="none", precision="fp32", precision_options=None, overlap=32,
+                 tile_batch=8, compress_level=None, start_method="fork", retention=86400):
+        self.db = db
+        self.spool_dir = os.path.abspath(spool_dir)
+        self.on_complete = on_complete  # on_complete(sender, receiver, image_bytes, model_version) -> message id
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.retention = retention
+        self.last_prune = 0.0
+        torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # "fork" by default: spawn/forkserver children re-import the __main__ module, which is app.py
+        self.mp_context = multiprocessing.get_context(start_method)
+        self.initargs = (model_files, mean, std, engine_mode, compile_mode, precision, precision_options,
+                         torch_threads, overlap, tile_batch, compress_level)
+        self.cond = threading.Condition()
+        self.pid = None
+        self.pool = None
+        self.thread = None
+        self.in_flight = 0
+        self.avg_seconds = 5.0
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def _spool_paths(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.cover"), os.path.join(self.spool_dir, f"{job_id}.secret")
+
+    def start(self):
+        with self.cond:
+            if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.in_flight = 0
+            self._recover()
+            self.pool = self._new_pool()
+            self.thread = threading.Thread(target=self._dispatch, name="stegonet-job-dispatcher", daemon=True)
+            self.thread.start()
+
+    def reload(self, model_files):
+        # Later jobs run on a new pool loaded from `model_files`; jobs already handed to the
+        # old pool finish there and its processes exit once they are done
+        with self.cond:
+            if model_files == self.initargs[0]:
+                return
+            self.initargs = (model_files,) + self.initargs[1:]
+            # A pool inherited across fork is not ours to replace; start() builds a fresh one
+            old_pool = self.pool if self.pid == os.getpid() else None
+            if old_pool is not None:
+                self.pool = self._new_pool()
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+            logger.info("Job workers restarted with new model weights")
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context,
+                                   initializer=_worker_init, initargs=self.initargs)
+
+    def _recover(self):
+        # Jobs left running by a process that no longer exists go back to the queue
+        rows = self.db.query("SELECT id, owner_pid FROM jobs WHERE status='running'")
+        stale = [job_id for job_id, owner in rows if owner == os.getpid() or not _pid_alive(owner)]
+        if stale:
+            with self.db.transaction(immediate=True) as c:
+                c.executemany("UPDATE jobs SET status='queued', owner_pid=NULL, updated_at=? WHERE id=? AND status='running'",
+                              [(time.time(), job_id) for job_id in stale])
+            logger.info(f"Requeued {len(stale)} interrupted jobs")
+
+    def retry_after(self, pending):
+        return max(1, min(60, math.ceil(self.avg_seconds * pending / self.workers)))
+
+    def submit(self, sender, receiver, cover_bytes, secret_bytes, tiled=False):
+        self.start()
+        job_id = uuid.uuid4().hex
+        cover_path, secret_path = self._spool_paths(job_id)
+        with open(cover_path, "wb") as f:
+            f.write(cover_bytes)
+        with open(secret_path, "wb") as f:
+            f.write(secret_bytes)
+        now = time.time()
+        try:
+            with self.db.transaction(immediate=True) as c:
+                pending = c.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+                if pending >= self.max_pending:
+                    raise QueueFull(self.retry_after(pending))
+                c.execute("INSERT INTO jobs (id, status, sender, receiver, tiled, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                          (job_id, sender, receiver, int(bool(tiled)), now, now))
+        except Exception:
+            self._remove_spool(job_id)
+            raise
+        with self.cond:
+            self.cond.notify_all()
+        return job_id
+
+    def _claim(self):
+        with self.db.transaction(immediate=True) as c:
+            row = c.execute("SELECT id, sender, receiver, tiled FROM jobs WHERE status='queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            c.execute("UPDATE jobs SET status='running', owner_pid=?, updated_at=? WHERE id=?", (os.getpid(), time.time(), row[0]))
+        return row
+
+    def _dispatch(self):
+        while True:
+            with self.cond:
+                while self.in_flight >= self.workers:
+                    self.cond.wait()
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Could not claim job: {str(e)}")
+                job = None
+            if job is None:
+                self._prune()
+                with self.cond:
+                    # Also poll periodically for jobs queued by other processes
+                    self.cond.wait(1.0)
+                continue
+            job_id, sender, receiver, tiled = job
+            cover_path, secret_path = self._spool_paths(job_id)
+            started = time.time()
+            try:
+                future, pool = self._submit(cover_path, secret_path, bool(tiled))
+            except Exception as e:
+                logger.error(f"Job {job_id} failed, could not start it: {str(e)}")
+                self._abandon(job_id, str(e))
+                continue
+            future.add_done_callback(lambda f, job=(job_id, sender, receiver, started, pool): self._finish(f, *job))
+
+    def _submit(self, cover_path, secret_path, tiled):
+        # Under the lock, so reload() cannot shut the pool down between reading and using it.
+        # A pool that turns out to be broken is replaced and the job is tried once more.
+        with self.cond:
+            try:
+                future = self.pool.submit(_run_hide_job, cover_path, secret_path, tiled)
+            except BrokenProcessPool:
+                self._replace_pool(self.pool)
+                future = self.pool.submit(_run_hide_job, cover_path, secret_path, tiled)
+            self.in_flight += 1
+            return future, self.pool
+
+    def _replace_pool(self, broken):
+        # Called with the lock held; several jobs failing on the same pool only replace it once
+        if self.pool is broken and self.pid == os.getpid():
+            self.pool = self._new_pool()
+            broken.shutdown(wait=False)
+
+    def _abandon(self, job_id, error):
+        self._remove_spool(job_id)
+        try:
+            self._update(job_id, "failed", error=error)
+        except Exception as e:
+            logger.error(f"Could not mark job {job_id} as failed: {str(e)}")
+
+    def _finish(self, future, job_id, sender, receiver, started, pool):
+        try:
+            image_bytes, model_version = future.result()
+            message_id = self.on_complete(sender, receiver, image_bytes, model_version)
+            self._update(job_id, "done", message_id=message_id)
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.time() - started)
+            logger.info(f"Job {job_id} finished as message {message_id}")
+        except BrokenProcessPool as e:
+            logger.error(f"Job {job_id} failed, worker process died: {str(e)}")
+            with self.cond:
+                self._replace_pool(pool)
+            self._update(job_id, "failed", error="Worker process died")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            self._update(job_id, "failed", error=str(e))
+        finally:
+            self._remove_spool(job_id)
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify_all()
+
+    def _update(self, job_id, status, message_id=None, error=None):
+        with self.db.transaction(immediate=True) as c:
+            c.execute("UPDATE jobs SET status=?, message_id=?, error=?, updated_at=? WHERE id=?",
+                      (status, message_id, error, time.time(), job_id))
+
+    def _prune(self):
+        # Finished jobs are kept for `retention` seconds so clients can still poll them
+        now = time.time()
+        if now - self.last_prune < 60:
+            return
+        self.last_prune = now
+        try:
+            with self.db.transaction(immediate=True) as c:
+                c.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (now - self.retention,))
+        except Exception as e:
+            logger.warning(f"Could not prune finished jobs: {str(e)}")
+
+    def _remove_spool(self, job_id):
+        for path in self._spool_paths(job_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def status(self, job_id, wait=0.0):
+        # Long-polls up to `wait` seconds for the job to reach a terminal status
+        deadline = time.time() + wait
+        while True:
+            row = self.db.query_one("SELECT id, status, message_id, error, created_at, updated_at FROM jobs WHERE id=?", (job_id,))
+            if row is None:
+                return None
+            remaining = deadline - time.time()
+            if row[1] in TERMINAL_STATUSES or remaining <= 0:
+                break
+            with self.cond:
+                self.cond.wait(min(remaining, 1.0))
+        return {"job_id": row[0], "status": row[1], "message_id": row[2], "error": row[3],
+                "created_at": row[4], "updated_at": row[5]}
+
+    def stats(self):
+        counts = dict(self.db.query("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "avg_job_seconds": self.avg_seconds,
+            "statuses": counts,
+        }
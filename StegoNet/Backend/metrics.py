@@ -0,0 +1,265 @@
+import os
+import sys
+import math
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans sub-millisecond DB reads up to multi-second tiled inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        # (suffix, label values, extra label pairs, value)
+        raise NotImplementedError
+
+    def render(self, constant_labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            labels = _format_labels(self.labelnames, values, tuple(extra) + tuple(constant_labels))
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Counter, self).__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [("", key, (), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    # Either set() explicitly or read from `function` at scrape time. The function returns a
+    # number, or for labelled gauges a {label values tuple: number} dict.
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.function = function
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                result = self.function()
+            except Exception as e:
+                logger.warning(f"Gauge {self.name} could not be read: {str(e)}")
+                return []
+            values = result if isinstance(result, dict) else {(): result}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [("", tuple(str(v) for v in key), (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            snapshot = {key: list(series) for key, series in self.series.items()}
+        samples = []
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append(("_sum", key, (), series[-2]))
+            samples.append(("_count", key, (), series[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self, constant_labels=None):
+        # constant_labels ({name: value}) are added to every sample
+        pairs = tuple((constant_labels or {}).items())
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render(pairs) for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=(), registry=REGISTRY):
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), function=None, registry=REGISTRY):
+    return registry.register(Gauge(name, documentation, labelnames, function))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+class SlowRequestProfiler:
+    # Samples the stacks of threads serving requests every `interval_ms`. When a request takes
+    # longer than `threshold_ms`, its samples are written in collapsed-stack format
+    # ("frame;frame;frame count" per line), which flamegraph.pl and speedscope read directly.
+    # `extra_threads()` returns threads that do work on the request's behalf, such as the
+    # batch scheduler; they are sampled while any request is being profiled.
+    def __init__(self, threshold_ms, output_dir, interval_ms=5.0, extra_threads=None, max_files=200):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.output_dir = os.path.abspath(output_dir)
+        self.extra_threads = extra_threads or (lambda: [])
+        self.max_files = max_files
+        self.cond = threading.Condition()
+        self.active = {}  # thread ident -> Tally of stacks
+        self.thread = None
+        self.pid = None
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _ensure_started(self):
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.active = {}
+        self.thread = threading.Thread(target=self._loop, name="stegonet-profiler", daemon=True)
+        self.thread.start()
+
+    def begin(self):
+        with self.cond:
+            self._ensure_started()
+            self.active[threading.get_ident()] = Tally()
+            self.cond.notify()
+
+    def end(self, name, elapsed):
+        with self.cond:
+            stacks = self.active.pop(threading.get_ident(), None)
+        if stacks and elapsed >= self.threshold:
+            self._write(name, elapsed, stacks)
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.active:
+                    self.cond.wait()
+                idents = list(self.active)
+            frames = sys._current_frames()
+            extra = [thread for thread in self.extra_threads() if thread is not None and thread.ident in frames]
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = {}
+            for ident in idents:
+                stack = [self._collapse(names.get(ident, str(ident)), frames.get(ident))]
+                stack.extend(self._collapse(thread.name, frames[thread.ident]) for thread in extra)
+                samples[ident] = [s for s in stack if s]
+            with self.cond:
+                for ident, stacks in samples.items():
+                    tally = self.active.get(ident)
+                    if tally is not None:
+                        tally.update(stacks)
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        if not parts:
+            return None
+        parts.append(thread_name)
+        return ";".join(reversed(parts))
+
+    def _write(self, name, elapsed, stacks):
+        try:
+            existing = sorted(os.listdir(self.output_dir))
+            for old in existing[:max(0, len(existing) - self.max_files + 1)]:
+                os.remove(os.path.join(self.output_dir, old))
+            safe_name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name)
+            path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{safe_name}.folded")
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.warning(f"Slow request {name} took {elapsed * 1000:.0f} ms; stack samples written to {path}")
+        except OSError as e:
+            logger.error(f"Could not write profile for slow request {name}: {str(e)}")
@@ -0,0 +1,57 @@
+import argparse
+import logging
+from blobstore import open_blob_store, add_ref
+from db import Database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def migrate(db_path, blob_store, batch_size=100, drop_column=True, vacuum=True):
+    database = Database(db_path)
+    database.migrate()
+    if "stego_image" not in database.columns("messages"):
+        logger.info("messages has no stego_image column; nothing to migrate.")
+        return 0
+
+    moved = 0
+    last_id = 0
+    while True:
+        with database.transaction(immediate=True) as c:
+            c.execute("SELECT id, stego_image FROM messages WHERE id > ? AND stego_image IS NOT NULL ORDER BY id LIMIT ?",
+                      (last_id, batch_size))
+            rows = c.fetchall()
+            for msg_id, image_bytes in rows:
+                image_hash = blob_store.put(image_bytes)
+                add_ref(c, image_hash, len(image_bytes))
+                c.execute("UPDATE messages SET image_hash=?, image_size=?, stego_image=NULL WHERE id=?",
+                          (image_hash, len(image_bytes), msg_id))
+                last_id = msg_id
+        if not rows:
+            break
+        moved += len(rows)
+        logger.info(f"Moved {moved} images to the blob store")
+
+    with database.connection() as conn:
+        if drop_column:
+            conn.execute("ALTER TABLE messages DROP COLUMN stego_image")
+            logger.info("Dropped messages.stego_image")
+        if vacuum:
+            conn.execute("VACUUM")
+            logger.info("Vacuumed database")
+    database.close_all()
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move stego images out of the messages table into the blob store.")
+    parser.add_argument("--db", default="users.db")
+    parser.add_argument("--blob-store", default="local")
+    parser.add_argument("--blob-dir", default="blobs")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--keep-column", action="store_true", help="Leave the emptied stego_image column in place")
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+    total = migrate(args.db, open_blob_store(args.blob_store, args.blob_dir), batch_size=args.batch_size,
+                    drop_column=not args.keep_column, vacuum=not args.no_vacuum)
+    print(f"Migrated {total} messages.")
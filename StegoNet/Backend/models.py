@@ -1,8 +1,7 @@
 import torch
 import torch.nn as nn
-import torchvision.transforms as transforms
-from PIL import Image
 import io
+from preprocess import tensor_to_image
 
 class PreparationNetwork(nn.Module):
     def __init__(self):
@@ -70,15 +69,16 @@ class RevealNetwork(nn.Module):
         return self.final_conv(combined)
 
 def tensor_to_pil(image_tensor, mean, std):
-    denormalize = transforms.Normalize(
-        mean=[-m / s for m, s in zip(mean, std)],
-        std=[1 / s for s in std]
-    )
-    denormalized_tensor = denormalize(image_tensor.squeeze(0).cpu())
-    transform_to_pil = transforms.ToPILImage()
-    return transform_to_pil(torch.clamp(denormalized_tensor, 0, 1))
+    return tensor_to_image(image_tensor.squeeze(0), mean, std)
 
-def pil_to_bytes(pil_image, format='PNG'):
+def pil_to_bytes(pil_image, format='PNG', compress_level=None):
+    # compress_level trades encode CPU for size: 0-9 for PNG (zlib level, PIL default 6),
+    # 0-6 for WebP, which is always written lossless so pixels round-trip exactly
+    options = {}
+    if format == 'PNG' and compress_level is not None:
+        options['compress_level'] = compress_level
+    elif format == 'WEBP':
+        options = {'lossless': True, 'method': 4 if compress_level is None else compress_level}
     img_byte_arr = io.BytesIO()
-    pil_image.save(img_byte_arr, format=format)
+    pil_image.save(img_byte_arr, format=format, **options)
     return img_byte_arr.getvalue()
\ No newline at end of file
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import torch
+from models import PreparationNetwork, HidingNetwork, RevealNetwork, tensor_to_pil
+from engine import build_engine, verify_equivalence
+from precision import apply_precision, PrecisionRejected
+from tiling import hide_tiled, reveal_tiled
+from preprocess import image_to_tensor, IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidWeights(Exception):
+    # The checkpoint itself cannot be used: unreadable, or not matching the network architecture
+    pass
+
+
+def weights_hash(model_files):
+    digest = hashlib.sha256()
+    for name in ("prep_net", "hide_net", "reveal_net"):
+        with open(model_files[name], "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def load_weights(module, path, device):
+    # Each process holds a private copy (the fused engine copies the parameters again anyway);
+    # preforked workers share the master's copy only until they write to those pages
+    try:
+        module.load_state_dict(torch.load(path, map_location=device, weights_only=True))
+    except (OSError, MemoryError, torch.OutOfMemoryError):
+        # Missing files and exhausted memory say nothing about the weights; callers may retry
+        raise
+    except Exception as e:
+        raise InvalidWeights(f"{path}: {str(e)}") from e
+    return module.eval()
+
+
+def load_networks(model_files, device, engine_mode="fused", compile_mode="none", precision="fp32", **precision_options):
+    # Returns (prep_net, hide_net, reveal_net, weights_hash, precision) ready for inference.
+    # A reduced precision that fails its quality check falls back to fp32; the returned
+    # precision is the one actually in use.
+    prep_net = load_weights(PreparationNetwork().to(device), model_files["prep_net"], device)
+    hide_net = load_weights(HidingNetwork().to(device), model_files["hide_net"], device)
+    reveal_net = load_weights(RevealNetwork().to(device), model_files["reveal_net"], device)
+    reference = (prep_net, hide_net, reveal_net)
+    networks = reference
+    if engine_mode == "fused":
+        try:
+            optimized = build_engine(prep_net, hide_net, reveal_net, device, compile_mode=compile_mode)
+            errors = verify_equivalence(networks, optimized, device)
+            logger.info(f"Optimized inference engine verified against reference (max abs diff {errors})")
+            networks = optimized
+        except Exception as e:
+            logger.error(f"Optimized inference engine unavailable, using reference modules: {str(e)}")
+    if precision != "fp32":
+        try:
+            networks, report = apply_precision(reference, networks, precision, device, **precision_options)
+            logger.info(f"Running inference in {precision}; quality against fp32: {report}")
+        except PrecisionRejected as e:
+            logger.error(f"Refusing {precision} inference, using fp32: {str(e)}")
+            precision = "fp32"
+    return networks + (weights_hash(model_files), precision)
+
+
+def warm_up(prep_net, hide_net, reveal_net, device, batch_sizes=(1,), image_size=IMAGE_SIZE):
+    # One forward pass per batch size so kernel selection and allocator growth happen before
+    # the first request; in a preloading server this runs once in the master before forking
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            image = torch.zeros(batch_size, 3, image_size, image_size, device=device)
+            reveal_net(hide_net(image, prep_net(image)))
+
+
+def hide_image(cover_image, secret_image, prep_net, hide_net, mean, std, device, tiled=False, overlap=32, tile_batch=8):
+    def hide_fn(cover_batch, secret_batch):
+        cover_batch, secret_batch = cover_batch.to(device), secret_batch.to(device)
+        return hide_net(cover_batch, prep_net(secret_batch))
+
+    with torch.no_grad():
+        if tiled:
+            return hide_tiled(cover_image, secret_image, hide_fn, mean, std, overlap=overlap, batch_size=tile_batch)
+        stego = hide_fn(image_to_tensor(cover_image, mean, std), image_to_tensor(secret_image, mean, std))
+    return tensor_to_pil(stego, mean, std)
+
+
+def reveal_image(stego_image, reveal_net, mean, std, device, overlap=32, tile_batch=8):
+    def reveal_fn(stego_batch):
+        return reveal_net(stego_batch.to(device))
+
+    with torch.no_grad():
+        if stego_image.size != (IMAGE_SIZE, IMAGE_SIZE):
+            return reveal_tiled(stego_image, reveal_fn, mean, std, overlap=overlap, batch_size=tile_batch)
+        revealed = reveal_fn(image_to_tensor(stego_image, mean, std))
+    return tensor_to_pil(revealed, mean, std)
@@ -0,0 +1,166 @@
+import os
+import math
+import copy
+import logging
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from preprocess import MEAN, STD, IMAGE_SIZE, image_to_tensor, uint8_to_tensor
+from engine import OptimizedNetwork
+
+logger = logging.getLogger(__name__)
+
+# fp32: full precision. bf16: bfloat16 autocast over the fused engine. int8: static
+# post-training quantization (per-channel weights, calibrated activations) of the convs.
+PRECISIONS = ("fp32", "bf16", "int8")
+DEFAULT_MIN_PSNR = 30.0
+DEFAULT_MIN_SSIM = 0.95
+CALIBRATION_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+class PrecisionRejected(Exception):
+    pass
+
+
+class AutocastNetwork(torch.nn.Module):
+    # Runs `module` under autocast and hands back fp32, so callers never see bf16 tensors
+    def __init__(self, module, device_type="cpu", dtype=torch.bfloat16):
+        super(AutocastNetwork, self).__init__()
+        self.module = module
+        self.device_type = device_type
+        self.dtype = dtype
+
+    def forward(self, *inputs):
+        with torch.autocast(self.device_type, dtype=self.dtype):
+            return self.module(*inputs).float()
+
+
+def _synthetic_images(count, size, seed):
+    # Smooth colour fields plus noise; stands in for photos when no calibration set is given
+    rng = np.random.RandomState(seed)
+    images = []
+    for _ in range(count):
+        coarse = Image.fromarray(rng.randint(0, 256, (8, 8, 3), dtype=np.uint8)).resize((size, size), Image.BICUBIC)
+        pixels = np.asarray(coarse, dtype=np.int16) + rng.randint(-12, 13, (size, size, 3))
+        images.append(np.clip(pixels, 0, 255).astype(np.uint8))
+    return images
+
+
+def calibration_batches(directory=None, count=16, size=IMAGE_SIZE, mean=MEAN, std=STD, seed=0):
+    # Returns normalized (covers, secrets) batches of `count` images each
+    tensors = []
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if len(tensors) == 2 * count:
+                break
+            if name.lower().endswith(CALIBRATION_EXTENSIONS):
+                try:
+                    tensors.append(image_to_tensor(os.path.join(directory, name), mean, std, size))
+                except Exception as e:
+                    logger.warning(f"Skipping calibration image {name}: {str(e)}")
+    elif directory:
+        logger.warning(f"Calibration directory {directory} not found, using synthetic images")
+    missing = 2 * count - len(tensors)
+    if missing > 0:
+        tensors.append(uint8_to_tensor(np.stack(_synthetic_images(missing, size, seed)), mean, std))
+    images = torch.cat(tensors)
+    return images[:count], images[count:2 * count]
+
+
+def _quantize(module, example_inputs, calibration_inputs, backend):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    prepared = prepare_fx(copy.deepcopy(module).eval(), get_default_qconfig_mapping(backend), example_inputs)
+    with torch.no_grad():
+        for inputs in calibration_inputs:
+            prepared(*inputs)
+    return convert_fx(prepared)
+
+
+def quantize_int8(prep_net, hide_net, reveal_net, covers, secrets, batch_size=4):
+    # Static quantization of the reference modules. Observers see the fp32 activations each
+    # network receives in service: secrets for prep, (cover, prepared) for hide, stego for reveal.
+    backend = "x86" if "x86" in torch.backends.quantized.supported_engines else torch.backends.quantized.engine
+    torch.backends.quantized.engine = backend
+    cover_batches, secret_batches = covers.split(batch_size), secrets.split(batch_size)
+    with torch.no_grad():
+        prepared = [prep_net(secret) for secret in secret_batches]
+        stego = [hide_net(cover, prep) for cover, prep in zip(cover_batches, prepared)]
+    quantized_prep = _quantize(prep_net, (secret_batches[0],), [(s,) for s in secret_batches], backend)
+    quantized_hide = _quantize(hide_net, (cover_batches[0], prepared[0]), list(zip(cover_batches, prepared)), backend)
+    quantized_reveal = _quantize(reveal_net, (stego[0],), [(s,) for s in stego], backend)
+    return tuple(OptimizedNetwork(module, channels_last=False) for module in (quantized_prep, quantized_hide, quantized_reveal))
+
+
+def _to_unit(batch, mean, std):
+    mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+    std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+    return (batch.float().cpu() * std + mean).clamp_(0, 1)
+
+
+def psnr(expected, actual):
+    # Images in [0, 1]
+    mse = F.mse_loss(actual, expected).item()
+    return float("inf") if mse == 0 else 10.0 * math.log10(1.0 / mse)
+
+
+def ssim(expected, actual, window_size=11, sigma=1.5):
+    # Mean SSIM over all channels with the usual 11x11 Gaussian window; images in [0, 1]
+    coords = torch.arange(window_size, dtype=torch.float32) - window_size // 2
+    gauss = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    gauss = gauss / gauss.sum()
+    channels = expected.shape[1]
+    window = (gauss[:, None] * gauss[None, :]).expand(channels, 1, window_size, window_size).contiguous()
+
+    def blur(x):
+        return F.conv2d(x, window, groups=channels)
+
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    mu_x, mu_y = blur(expected), blur(actual)
+    sigma_x = blur(expected * expected) - mu_x ** 2
+    sigma_y = blur(actual * actual) - mu_y ** 2
+    sigma_xy = blur(expected * actual) - mu_x * mu_y
+    score = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+    return score.mean().item()
+
+
+def quality_report(reference, candidate, covers, secrets, mean=MEAN, std=STD, device=None):
+    # PSNR/SSIM of the candidate's stego and revealed images against the fp32 reference.
+    # Each pipeline runs end to end, so errors compound the way they do in service.
+    ref_prep, ref_hide, ref_reveal = reference
+    prep, hide, reveal = candidate
+    covers, secrets = covers.to(device), secrets.to(device)
+    with torch.no_grad():
+        ref_stego = ref_hide(covers, ref_prep(secrets))
+        ref_revealed = ref_reveal(ref_stego)
+        stego = hide(covers, prep(secrets))
+        revealed = reveal(stego)
+    report = {}
+    for name, expected, actual in (("stego", ref_stego, stego), ("revealed", ref_revealed, revealed)):
+        expected, actual = _to_unit(expected, mean, std), _to_unit(actual, mean, std)
+        report[name] = {"psnr": psnr(expected, actual), "ssim": ssim(expected, actual)}
+    return report
+
+
+def apply_precision(reference, fp32_networks, precision, device, calibration_dir=None, calibration_count=16,
+                    min_psnr=DEFAULT_MIN_PSNR, min_ssim=DEFAULT_MIN_SSIM, mean=MEAN, std=STD):
+    # Returns (networks, report) for `precision`; raises PrecisionRejected when it misses the quality bar
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Expected one of {list(PRECISIONS)}")
+    if precision == "fp32":
+        return fp32_networks, None
+    covers, secrets = calibration_batches(calibration_dir, calibration_count, mean=mean, std=std)
+    if precision == "int8":
+        if device.type != "cpu":
+            raise PrecisionRejected("int8 inference is only available on CPU")
+        networks = quantize_int8(*reference, covers, secrets)
+    else:
+        networks = tuple(AutocastNetwork(network, device.type) for network in fp32_networks)
+    report = quality_report(reference, networks, covers, secrets, mean, std, device)
+    for name, scores in report.items():
+        if scores["psnr"] < min_psnr or scores["ssim"] < min_ssim:
+            raise PrecisionRejected(f"{precision} {name} output is below the quality threshold "
+                                    f"(PSNR {scores['psnr']:.2f} dB / SSIM {scores['ssim']:.4f}, "
+                                    f"required {min_psnr} dB / {min_ssim})")
+    return networks, report
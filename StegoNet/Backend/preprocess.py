@@ -0,0 +1,65 @@
+import functools
+import numpy as np
+import torch
+from PIL import Image
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+IMAGE_SIZE = 256
+REDUCING_GAP = 3.0
+
+
+@functools.lru_cache(maxsize=8)
+def normalization_constants(mean=MEAN, std=STD):
+    # uint8 -> normalized float is x * scale - offset; the inverse is y * inv_scale + inv_offset
+    mean = torch.tensor(mean, dtype=torch.float32)
+    std = torch.tensor(std, dtype=torch.float32)
+    scale = (1.0 / (255.0 * std)).view(1, 3, 1, 1)
+    offset = (mean / std).view(1, 3, 1, 1)
+    inv_scale = (255.0 * std).view(1, 1, 1, 3)
+    inv_offset = (255.0 * mean).view(1, 1, 1, 3)
+    return scale, offset, inv_scale, inv_offset
+
+
+def uint8_to_tensor(array, mean=MEAN, std=STD):
+    # HxWx3 or NxHxWx3 uint8 array -> normalized Nx3xHxW float tensor
+    scale, offset, _, _ = normalization_constants(tuple(mean), tuple(std))
+    # Arrays viewing PIL images are read-only; torch warns on those, so they get a writable copy
+    batch = torch.from_numpy(np.require(array, requirements=("C", "W")))
+    if batch.dim() == 3:
+        batch = batch.unsqueeze(0)
+    batch = batch.permute(0, 3, 1, 2).to(torch.float32)
+    return batch.mul_(scale).sub_(offset)
+
+
+def tensor_to_uint8(tensor, mean=MEAN, std=STD):
+    # Normalized (N)x3xHxW tensor -> (N)xHxWx3 uint8 array, truncating like ToPILImage
+    _, _, inv_scale, inv_offset = normalization_constants(tuple(mean), tuple(std))
+    squeeze = tensor.dim() == 3
+    batch = tensor.detach().unsqueeze(0) if squeeze else tensor.detach()
+    pixels = batch.to("cpu", torch.float32).permute(0, 2, 3, 1).mul(inv_scale).add_(inv_offset).clamp_(0, 255)
+    array = pixels.to(torch.uint8).numpy()
+    return array[0] if squeeze else array
+
+
+def decode_image(source, size=IMAGE_SIZE):
+    # Decodes straight to size x size RGB. JPEGs are downscaled by the decoder (draft mode) first;
+    # other formats are box-reduced by an integer factor before the bilinear pass (reducing_gap),
+    # so the resize never works on more than a few times the target size.
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    if size is not None and image.format == "JPEG":
+        image.draft("RGB", (size, size))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if size is not None and image.size != (size, size):
+        image = image.resize((size, size), Image.BILINEAR, reducing_gap=REDUCING_GAP)
+    return image
+
+
+def image_to_tensor(source, mean=MEAN, std=STD, size=IMAGE_SIZE, device=None):
+    tensor = uint8_to_tensor(np.asarray(decode_image(source, size)), mean, std)
+    return tensor.to(device) if device is not None else tensor
+
+
+def tensor_to_image(tensor, mean=MEAN, std=STD):
+    return Image.fromarray(tensor_to_uint8(tensor[0] if tensor.dim() == 4 else tensor, mean, std))
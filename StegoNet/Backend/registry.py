@@ -0,0 +1,217 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pipeline import weights_hash, InvalidWeights
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAMES = ("prep_net", "hide_net", "reveal_net")
+
+
+class ModelVersion:
+    # One loaded set of weights. Requests take a reference when they start and keep it to the
+    # end, so a swap never changes the networks under an in-flight request.
+    def __init__(self, version, prep_net, hide_net, reveal_net, precision="fp32"):
+        self.version = version
+        self.prep_net = prep_net
+        self.hide_net = hide_net
+        self.reveal_net = reveal_net
+        self.precision = precision
+        # Reduced-precision reveals differ slightly from fp32 ones, so they are cached separately
+        self.cache_key = version if precision == "fp32" else f"{version}-{precision}"
+
+
+def _signature(model_files):
+    try:
+        return tuple((st.st_ino, st.st_size, st.st_mtime_ns) for st in (os.stat(model_files[name]) for name in MODEL_NAMES))
+    except FileNotFoundError:
+        return None
+
+
+class ModelRegistry:
+    # Weight sets keyed by the SHA-256 of their files. Every registered version is archived
+    # under directory/<version>/ and recorded in the model_versions table, so messages can be
+    # revealed with the weights that hid them after the deployed .pth files have changed.
+    # `loader(model_files)` returns a loaded, warmed-up ModelVersion.
+    def __init__(self, db, directory, loader, max_loaded=2):
+        self.db = db
+        self.directory = os.path.abspath(directory)
+        self.loader = loader
+        self.max_loaded = max(1, max_loaded)
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()
+        self.load_locks = {}
+        self.active = None
+        self.failed = set()
+        self.swaps = 0
+        self.thread = None
+        self.pid = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def files(self, version):
+        folder = os.path.join(self.directory, version)
+        return {name: os.path.join(folder, f"{name}.pth") for name in MODEL_NAMES}
+
+    def register(self, model_files):
+        # Returns (version, created); created is True only if this call archived the files
+        version = weights_hash(model_files)
+        if os.path.isdir(os.path.join(self.directory, version)):
+            return version, False
+        created = False
+        # New weights are copied first and the copy is hashed, so a deploy that replaces the
+        # files mid-copy cannot leave an archive whose contents disagree with its version
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            for name in MODEL_NAMES:
+                shutil.copyfile(model_files[name], os.path.join(staging, f"{name}.pth"))
+            version = weights_hash({name: os.path.join(staging, f"{name}.pth") for name in MODEL_NAMES})
+            folder = os.path.join(self.directory, version)
+            if not os.path.isdir(folder):
+                try:
+                    os.rename(staging, folder)
+                    created = True
+                except OSError:
+                    # Another worker archived the same version first
+                    pass
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        with self.db.transaction(immediate=True) as c:
+            c.execute("INSERT OR IGNORE INTO model_versions (version, created_at) VALUES (?, ?)", (version, time.time()))
+        return version, created
+
+    def get(self, version):
+        # Returns the loaded version, loading it from the archive on first use; None if it was never archived
+        with self.lock:
+            model = self.loaded.get(version)
+            if model is not None:
+                self.loaded.move_to_end(version)
+                return model
+            load_lock = self.load_locks.setdefault(version, threading.Lock())
+        with load_lock:
+            with self.lock:
+                model = self.loaded.get(version)
+            if model is not None:
+                return model
+            files = self.files(version)
+            if not all(os.path.exists(path) for path in files.values()):
+                return None
+            started = time.perf_counter()
+            model = self.loader(files)
+            if model.version != version:
+                raise InvalidWeights(f"Archived weights for {version} hash to {model.version}")
+            logger.info(f"Loaded model version {version[:12]} ({model.precision}) in {time.perf_counter() - started:.1f}s")
+            with self.lock:
+                self.loaded[version] = model
+                self._evict()
+        return model
+
+    def _evict(self):
+        # Least recently used versions beyond max_loaded are dropped; the active one never is.
+        # Requests still holding an evicted version finish on it before it is freed.
+        for version in list(self.loaded):
+            if len(self.loaded) <= self.max_loaded:
+                return
+            if self.active is None or version != self.active.version:
+                del self.loaded[version]
+
+    def activate(self, version):
+        # Loads and warms up outside the lock, then switches with a single assignment
+        model = self.get(version)
+        if model is None:
+            raise KeyError(f"Model version {version} is not in the registry")
+        with self.lock:
+            previous = self.active
+            self.active = model
+            self.loaded.move_to_end(version)
+            if previous is not None and previous.version != version:
+                self.swaps += 1
+        with self.db.transaction(immediate=True) as c:
+            c.execute("UPDATE model_versions SET activated_at=? WHERE version=?", (time.time(), version))
+        if previous is None or previous.version != version:
+            logger.info(f"Model version {version[:12]} is now active" +
+                        (f", replacing {previous.version[:12]}" if previous is not None else ""))
+        return model
+
+    def deploy(self, model_files):
+        # Registers the deployed files and makes them active unless they already are. Errors
+        # other than InvalidWeights (missing files, memory, bad configuration) leave the version
+        # eligible, so the next deploy of the same files tries again.
+        version, created = self.register(model_files)
+        if self.active is not None and self.active.version == version:
+            return self.active
+        if version in self.failed:
+            if created:
+                self._discard(version)
+            return None
+        try:
+            return self.activate(version)
+        except InvalidWeights:
+            # Not retried until different weights are deployed
+            self.failed.add(version)
+            if created:
+                self._discard(version)
+            raise
+
+    def _discard(self, version):
+        # Only a version that was never active can be dropped; messages may refer to any other
+        with self.db.transaction(immediate=True) as c:
+            removed = c.execute("DELETE FROM model_versions WHERE version=? AND activated_at IS NULL", (version,)).rowcount
+        if removed:
+            shutil.rmtree(os.path.join(self.directory, version), ignore_errors=True)
+
+    def start_watcher(self, model_files, interval, on_activate=None):
+        # Threads do not survive fork, so a preforked worker starts its own watcher
+        if interval <= 0 or (self.thread is not None and self.thread.is_alive() and self.pid == os.getpid()):
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._watch, args=(model_files, interval, on_activate),
+                                       name="stegonet-model-watcher", daemon=True)
+        self.thread.start()
+
+    def _watch(self, model_files, interval, on_activate):
+        # A deploy renames three files into place one after another, so a change is only acted
+        # on once the files have stayed the same for a whole polling interval. Without an active
+        # version (the startup load failed) the current files count as not yet deployed.
+        seen = _signature(model_files)
+        settled = seen if self.active is not None else None
+        while True:
+            time.sleep(interval)
+            current = _signature(model_files)
+            if current != seen:
+                seen = current
+                continue
+            if current is None or current == settled:
+                continue
+            settled = current
+            try:
+                previous = self.active
+                model = self.deploy(model_files)
+                if model is not None and model is not previous and on_activate is not None:
+                    on_activate(model)
+            except InvalidWeights as e:
+                logger.error(f"Could not load the new model files, keeping the current version: {str(e)}")
+            except Exception as e:
+                # Not a problem with the weights; tried again on the next interval
+                settled = None
+                logger.error(f"Could not load the new model files, retrying in {interval:g}s: {str(e)}")
+
+    def versions(self):
+        with self.lock:
+            loaded = set(self.loaded)
+            active = self.active.version if self.active is not None else None
+        counts = dict(self.db.query("SELECT model_version, COUNT(*) FROM messages GROUP BY model_version"))
+        rows = self.db.query("SELECT version, created_at, activated_at FROM model_versions ORDER BY created_at")
+        return {
+            "active": active,
+            "swaps": self.swaps,
+            "unversioned_messages": counts.get(None, 0),
+            "versions": [{"version": version, "created_at": created_at, "activated_at": activated_at,
+                          "active": version == active, "loaded": version in loaded,
+                          "archived": os.path.isdir(os.path.join(self.directory, version)),
+                          "messages": counts.get(version, 0)}
+                         for version, created_at, activated_at in rows],
+        }
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+import logging
+from collections import deque, Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    def __init__(self, max_batch_size=8, max_wait_ms=5.0, wait_samples=1024):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.handlers = {}
+        self.queues = {}
+        self.cond = threading.Condition()
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+
+        self.submitted = Counter()
+        self.completed = Counter()
+        self.failed = Counter()
+        self.batches = Counter()
+        self.batch_sizes = {}
+        self.max_depth = Counter()
+        self.wait_samples = deque(maxlen=wait_samples)
+
+    def register(self, kind, handler):
+        # handler(list_of_payloads) -> list of results, one per payload, same order
+        with self.cond:
+            self.handlers[kind] = handler
+            self.queues.setdefault(kind, deque())
+            self.batch_sizes.setdefault(kind, Counter())
+
+    def submit(self, kind, *payload):
+        if kind not in self.handlers:
+            raise KeyError(f"No batch handler registered for '{kind}'")
+        future = Future()
+        with self.cond:
+            self._ensure_started()
+            queue = self.queues[kind]
+            queue.append((payload, future, time.perf_counter()))
+            self.submitted[kind] += 1
+            if len(queue) > self.max_depth[kind]:
+                self.max_depth[kind] = len(queue)
+            self.cond.notify()
+        return future
+
+    def run(self, kind, *payload, timeout=None):
+        return self.submit(kind, *payload).result(timeout=timeout)
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so a forked worker starts its own loop on first use
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.stopping = False
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._loop, name="stegonet-batch-scheduler", daemon=True)
+        self.thread.start()
+
+    def _oldest_kind(self):
+        oldest = None
+        for kind, queue in self.queues.items():
+            if queue and (oldest is None or queue[0][2] < self.queues[oldest][0][2]):
+                oldest = kind
+        return oldest
+
+    def _next_batch(self):
+        with self.cond:
+            while True:
+                if self.stopping:
+                    return None, []
+                kind = self._oldest_kind()
+                if kind is None:
+                    self.cond.wait()
+                    continue
+                queue = self.queues[kind]
+                deadline = queue[0][2] + self.max_wait
+                remaining = deadline - time.perf_counter()
+                if len(queue) >= self.max_batch_size or remaining <= 0:
+                    size = min(len(queue), self.max_batch_size)
+                    return kind, [queue.popleft() for _ in range(size)]
+                self.cond.wait(remaining)
+
+    def _loop(self):
+        while True:
+            kind, batch = self._next_batch()
+            if kind is None:
+                return
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.wait_samples.append((started - enqueued) * 1000.0)
+            live = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                results = self.handlers[kind]([payload for payload, _, _ in live])
+                if len(results) != len(live):
+                    raise RuntimeError(f"Batch handler '{kind}' returned {len(results)} results for {len(live)} inputs")
+            except Exception as e:
+                logger.error(f"Batch '{kind}' of size {len(live)} failed: {str(e)}")
+                for _, future, _ in live:
+                    future.set_exception(e)
+                with self.cond:
+                    self.failed[kind] += len(live)
+                continue
+            for (_, future, _), result in zip(live, results):
+                future.set_result(result)
+            with self.cond:
+                self.completed[kind] += len(live)
+                self.batches[kind] += 1
+                self.batch_sizes[kind][len(live)] += 1
+
+    def shutdown(self, wait=True):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            thread = self.thread
+        if wait and thread is not None and thread.is_alive():
+            thread.join()
+
+    def stats(self):
+        with self.cond:
+            waits = sorted(self.wait_samples)
+            kinds = {}
+            for kind in self.handlers:
+                sizes = self.batch_sizes[kind]
+                batches = self.batches[kind]
+                kinds[kind] = {
+                    "queue_depth": len(self.queues[kind]),
+                    "max_queue_depth": self.max_depth[kind],
+                    "submitted": self.submitted[kind],
+                    "completed": self.completed[kind],
+                    "failed": self.failed[kind],
+                    "batches": batches,
+                    "mean_batch_size": (self.completed[kind] / batches) if batches else 0.0,
+                    "batch_size_histogram": {str(size): count for size, count in sorted(sizes.items())},
+                }
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_wait_ms": {
+                "samples": len(waits),
+                "p50": _percentile(waits, 50),
+                "p99": _percentile(waits, 99),
+                "max": waits[-1] if waits else 0.0,
+            },
+            "kinds": kinds,
+        }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,194 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from collections import OrderedDict, Counter
+
+logger = logging.getLogger(__name__)
+
+CACHE_EXTENSIONS = ("png", "webp")
+
+
+class SecretCache:
+    # LRU cache of revealed secrets keyed by (stego image hash, model weights hash, encoding),
+    # bounded by both total bytes and entry count, with an optional write-through disk tier.
+    # The disk tier may be shared by several processes (preforked workers): entries are looked
+    # up by path, a file's mtime is its last use, and the byte budget is enforced against
+    # what is actually in the directory rather than what this process wrote.
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=256, disk_dir=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.disk_dir = os.path.abspath(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        # Disk usage as of the last scan, for stats
+        self.disk_count = 0
+        self.disk_size = 0
+        self.counters = Counter()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._evict_disk()
+
+    def _disk_path(self, key):
+        stego_hash, model_hash, extension = key
+        return os.path.join(self.disk_dir, stego_hash, f"{model_hash}.{extension}")
+
+    def _scan_disk(self):
+        # (mtime, path, size) of every entry, least recently used first
+        found = []
+        for stego_hash in os.listdir(self.disk_dir):
+            folder = os.path.join(self.disk_dir, stego_hash)
+            try:
+                names = os.listdir(folder)
+            except (NotADirectoryError, FileNotFoundError):
+                continue
+            for name in names:
+                if name.rpartition(".")[2] not in CACHE_EXTENSIONS:
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        found.sort()
+        return found
+
+    def get(self, stego_hash, model_hash, extension="png"):
+        key = (stego_hash, model_hash, extension)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return data
+        if self.disk_dir:
+            # Looked up by path, so entries written by other processes are found too
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                with self.lock:
+                    self.counters["disk_hits"] += 1
+                    self._insert(key, data)
+                return data
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, stego_hash, model_hash, data, extension="png"):
+        key = (stego_hash, model_hash, extension)
+        with self.lock:
+            self._insert(key, data)
+        if self.disk_dir:
+            self._write_disk(key, data)
+
+    def _insert(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.counters["evictions"] += 1
+
+    def _write_disk(self, key, data):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write secret cache entry to disk: {str(e)}")
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        # Rescans the directory on every write. Writes follow a full reveal, which costs far
+        # more than listing the cache, and the scan sees every process's entries.
+        with self.disk_lock:
+            try:
+                found = self._scan_disk()
+            except OSError as e:
+                logger.warning(f"Could not scan the secret cache directory: {str(e)}")
+                return
+            total = sum(size for _, _, size in found)
+            evicted = 0
+            for _, path, size in found:
+                if total <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Already evicted or purged by another process
+                    pass
+                try:
+                    os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass
+                total -= size
+                evicted += 1
+            with self.lock:
+                self.disk_count = len(found) - evicted
+                self.disk_size = total
+                self.counters["disk_evictions"] += evicted
+
+    def purge(self, stego_hashes):
+        purged = disk_purged = disk_bytes = 0
+        stego_hashes = {h for h in stego_hashes if h}
+        with self.lock:
+            for key in [k for k in self.entries if k[0] in stego_hashes]:
+                self.size -= len(self.entries.pop(key))
+                purged += 1
+        if self.disk_dir:
+            for stego_hash in stego_hashes:
+                folder = os.path.join(self.disk_dir, stego_hash)
+                try:
+                    for entry in os.scandir(folder):
+                        if entry.name.rpartition(".")[2] in CACHE_EXTENSIONS:
+                            disk_purged += 1
+                            disk_bytes += entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+                shutil.rmtree(folder, ignore_errors=True)
+        with self.lock:
+            self.disk_count = max(0, self.disk_count - disk_purged)
+            self.disk_size = max(0, self.disk_size - disk_bytes)
+            self.counters["purged"] += purged + disk_purged
+        return purged + disk_purged
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.counters["hits"],
+                "disk_hits": self.counters["disk_hits"],
+                "misses": self.counters["misses"],
+                "evictions": self.counters["evictions"],
+                "purged": self.counters["purged"],
+                "hit_ratio": ((self.counters["hits"] + self.counters["disk_hits"]) / lookups) if lookups else 0.0,
+                "disk": {
+                    "enabled": self.disk_dir is not None,
+                    "entries": self.disk_count,
+                    "bytes": self.disk_size,
+                    "max_bytes": self.disk_max_bytes,
+                    "evictions": self.counters["disk_evictions"],
+                },
+            }
@@ -0,0 +1,112 @@
+import numpy as np
+import torch
+from PIL import Image
+from preprocess import uint8_to_tensor, tensor_to_uint8
+
+TILE_SIZE = 256
+
+
+def tile_origins(length, tile=TILE_SIZE, overlap=32):
+    # Tile start offsets along one axis; the last tile is aligned to the far edge
+    if length <= tile:
+        return [0]
+    stride = tile - overlap
+    if stride <= 0:
+        raise ValueError(f"Tile overlap {overlap} must be smaller than the tile size {tile}")
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def blend_window(tile=TILE_SIZE, overlap=32):
+    # Separable linear ramp over the overlap so neighbouring tiles cross-fade
+    ramp = torch.ones(tile)
+    if overlap > 0:
+        edge = torch.arange(1, overlap + 1, dtype=torch.float32) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge.flip(0)
+    return ramp[:, None] * ramp[None, :]
+
+
+def _pad_to_tile(array, tile):
+    height, width = array.shape[:2]
+    pad_h, pad_w = max(0, tile - height), max(0, tile - width)
+    if pad_h or pad_w:
+        array = np.pad(array, ((0, pad_h), (0, pad_w), (0, 0)), mode="reflect")
+    return array
+
+
+def run_tiled(readers, size, forward, mean, std, tile=TILE_SIZE, overlap=32, batch_size=8):
+    # readers: one callable per network input, reader(top, bottom) -> (bottom - top)xWx3 uint8 rows.
+    # forward(*normalized_batches) -> normalized (N, 3, tile, tile) output batch.
+    # Inputs are read one band of `tile` rows at a time and finished rows are pasted into the
+    # output immediately, so nothing but the output image is ever held at full resolution.
+    width, height = size
+    window = blend_window(tile, overlap)
+    padded_h, padded_w = max(height, tile), max(width, tile)
+
+    output = Image.new("RGB", size)
+    ys = tile_origins(padded_h, tile, overlap)
+    xs = tile_origins(padded_w, tile, overlap)
+    band = torch.zeros(3, tile, padded_w)
+    band_weight = torch.zeros(1, tile, padded_w)
+
+    for row, y in enumerate(ys):
+        arrays = [_pad_to_tile(reader(y, min(y + tile, height)), tile) for reader in readers]
+        for start in range(0, len(xs), batch_size):
+            chunk = xs[start:start + batch_size]
+            inputs = [
+                uint8_to_tensor(np.stack([array[:, x:x + tile] for x in chunk]), mean, std)
+                for array in arrays
+            ]
+            with torch.no_grad():
+                result = forward(*inputs).float().cpu()
+            for x, tile_out in zip(chunk, result):
+                band[:, :, x:x + tile] += tile_out * window
+                band_weight[:, :, x:x + tile] += window
+
+        next_y = ys[row + 1] if row + 1 < len(ys) else y + tile
+        done = next_y - y
+        rows = tensor_to_uint8(band[:, :done] / band_weight[:, :done], mean, std)
+        output.paste(Image.fromarray(np.ascontiguousarray(rows[:height - y, :width])), (0, y))
+
+        keep = tile - done
+        band = torch.cat((band[:, done:], torch.zeros(3, done, padded_w)), dim=1) if keep > 0 else torch.zeros_like(band)
+        band_weight = torch.cat((band_weight[:, done:], torch.zeros(1, done, padded_w)), dim=1) if keep > 0 else torch.zeros_like(band_weight)
+
+    return output
+
+
+def _crop_reader(image):
+    # Bands are cropped and converted on demand instead of converting the whole image up front
+    def read(top, bottom):
+        rows = image.crop((0, top, image.width, bottom))
+        return np.asarray(rows if rows.mode == "RGB" else rows.convert("RGB"))
+    return read
+
+
+def _resize_reader(image, size):
+    # Each band is resampled straight from the source, so the secret is never stretched to the
+    # full cover resolution; rows agree with a whole-image resize to within one level
+    if image.size == size:
+        return _crop_reader(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = size
+    scale = image.height / height
+
+    def read(top, bottom):
+        return np.asarray(image.resize((width, bottom - top), Image.BILINEAR,
+                                       box=(0, top * scale, image.width, bottom * scale)))
+    return read
+
+
+def hide_tiled(cover_image, secret_image, hide_fn, mean, std, tile=TILE_SIZE, overlap=32, batch_size=8):
+    # The secret is stretched to the cover's resolution so each cover tile carries the matching secret tile
+    return run_tiled([_crop_reader(cover_image), _resize_reader(secret_image, cover_image.size)],
+                     cover_image.size, hide_fn, mean, std, tile=tile, overlap=overlap, batch_size=batch_size)
+
+
+def reveal_tiled(stego_image, reveal_fn, mean, std, tile=TILE_SIZE, overlap=32, batch_size=8):
+    return run_tiled([_crop_reader(stego_image)], stego_image.size, reveal_fn, mean, std,
+                     tile=tile, overlap=overlap, batch_size=batch_size)
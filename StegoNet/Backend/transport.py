@@ -0,0 +1,76 @@
+import io
+import json
+import uuid
+from flask import Response, jsonify, request
+from PIL import Image
+from models import pil_to_bytes
+
+JSON_MIMETYPE = "application/json"
+MULTIPART_MIMETYPE = "multipart/mixed"
+# Raw image encodings a client can ask for instead of base64 inside JSON. Both are lossless,
+# so the revealed pixels are identical whichever one is chosen.
+IMAGE_FORMATS = {"image/png": "PNG", "image/webp": "WEBP"}
+FORMAT_ALIASES = {"json": JSON_MIMETYPE, "png": "image/png", "webp": "image/webp", "multipart": MULTIPART_MIMETYPE}
+
+
+def negotiate(offers):
+    # Picks the response type from the `format` parameter if given, otherwise from Accept.
+    # offers[0] is the fallback, so clients sending */* (browsers, axios) keep getting JSON.
+    # Returns None only when `format` names something this endpoint cannot produce.
+    override = request.values.get("format")
+    if override:
+        mimetype = FORMAT_ALIASES.get(override.lower())
+        return mimetype if mimetype in offers else None
+    return request.accept_mimetypes.best_match(offers, default=offers[0])
+
+
+def not_acceptable(offers):
+    response = Response(json.dumps({"error": f"Cannot produce the requested format. Available: {list(offers)}"}),
+                        status=406, mimetype=JSON_MIMETYPE)
+    response.vary.add("Accept")
+    return response
+
+
+def encode_image(image, mimetype, png_bytes=None, compress_level=None):
+    # `image` is a PIL image or None; `png_bytes` an existing PNG of it, returned untouched for
+    # PNG requests so stored and cached images are never decoded and re-encoded
+    if mimetype == "image/png" and png_bytes is not None:
+        return png_bytes
+    if image is None:
+        image = Image.open(io.BytesIO(png_bytes))
+    return pil_to_bytes(image, IMAGE_FORMATS[mimetype], compress_level)
+
+
+def json_response(payload, status=200):
+    # The JSON variant of a negotiated endpoint; Vary keeps shared caches from mixing representations
+    response = jsonify(payload)
+    response.status_code = status
+    response.vary.add("Accept")
+    return response
+
+
+def image_response(image_bytes, mimetype, headers=None):
+    response = Response(image_bytes, mimetype=mimetype, headers=headers)
+    response.vary.add("Accept")
+    return response
+
+
+def multipart_response(metadata, parts):
+    # Streams a multipart/mixed body: the JSON metadata first, then one part per image.
+    # `parts` yields (headers, body) pairs; bodies are only read as the response is written.
+    boundary = uuid.uuid4().hex
+
+    def part_header(headers):
+        lines = [f"--{boundary}"] + [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+    def generate():
+        body = json.dumps(metadata).encode("utf-8")
+        yield part_header({"Content-Type": JSON_MIMETYPE, "Content-Length": len(body)}) + body + b"\r\n"
+        for headers, body in parts:
+            yield part_header(dict(headers, **{"Content-Length": len(body)})) + body + b"\r\n"
+        yield f"--{boundary}--\r\n".encode("ascii")
+
+    response = Response(generate(), mimetype=f"{MULTIPART_MIMETYPE}; boundary={boundary}")
+    response.vary.add("Accept")
+    return response
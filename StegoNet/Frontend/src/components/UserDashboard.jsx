@@ -3,6 +3,8 @@ import axios from 'axios';
 import { Tab, Tabs, TabList, TabPanel } from 'react-tabs';
 import 'react-tabs/style/react-tabs.css';
 
+const API_BASE = 'https://stegonet-4.onrender.com';
+
 function UserDashboard({ user, handleLogout }) {
   const [users, setUsers] = useState([]);
   const [receiver, setReceiver] = useState('');
@@ -10,9 +12,18 @@ function UserDashboard({ user, handleLogout }) {
   const [secretImage, setSecretImage] = useState(null);
   const [stegoImage, setStegoImage] = useState(null);
   const [receivedImages, setReceivedImages] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [message, setMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
 
+  const fetchReceivedPage = async (cursor) => {
+    const response = await axios.get(`${API_BASE}/api/received-images/${user.username}`, {
+      params: cursor ? { cursor } : {},
+    });
+    setReceivedImages(prev => (cursor ? [...prev, ...response.data.items] : response.data.items));
+    setNextCursor(response.data.next_cursor);
+  };
+
   useEffect(() => {
     const fetchUsers = async () => {
       try {
@@ -24,16 +35,24 @@ function UserDashboard({ user, handleLogout }) {
     };
     const fetchReceivedImages = async () => {
       try {
-        const response = await axios.get(`https://stegonet-4.onrender.com/api/received-images/${user.username}`);
-        setReceivedImages(response.data);
+        await fetchReceivedPage(null);
       } catch (err) {
         setMessage('Error fetching received images: ' + (err.response?.data?.error || err.message));
       }
     };
     fetchUsers();
     fetchReceivedImages();
+    // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [user.username]);
 
+  const handleLoadMore = async () => {
+    try {
+      await fetchReceivedPage(nextCursor);
+    } catch (err) {
+      setMessage('Error fetching received images: ' + (err.response?.data?.error || err.message));
+    }
+  };
+
   const handleSendStego = async (e) => {
     e.preventDefault();
     if (isLoading) return;
@@ -49,11 +68,25 @@ function UserDashboard({ user, handleLogout }) {
     try {
       console.log('Sending stego image with:', { sender: user.username, receiver, coverImage, secretImage });
       const response = await axios.post('https://stegonet-4.onrender.com/api/send-stego', formData);
-      setStegoImage(response.data.stego_image);
-      setMessage(response.data.message);
+      if (response.status === 202) {
+        // Queued on the server: long-poll the job until it finishes
+        setMessage(response.data.message);
+        let job = { status: 'queued' };
+        while (job.status === 'queued' || job.status === 'running') {
+          const poll = await axios.get(`${API_BASE}${response.data.status_url}`, { params: { wait: 25 } });
+          job = poll.data;
+        }
+        if (job.status === 'failed') {
+          throw new Error(job.error || 'Stego job failed');
+        }
+        setStegoImage(`${API_BASE}${job.stego_image_url}`);
+        setMessage('Stego image sent');
+      } else {
+        setStegoImage(`data:image/png;base64,${response.data.stego_image}`);
+        setMessage(response.data.message);
+      }
       setTimeout(() => setMessage(''), 5000);
-      const updatedImages = await axios.get(`https://stegonet-4.onrender.com/api/received-images/${user.username}`);
-      setReceivedImages(updatedImages.data);
+      await fetchReceivedPage(null);
     } catch (err) {
       console.error('Error sending stego image:', err.response?.data);
       setMessage(`Error sending stego image: ${err.response?.data?.error || err.message}`);
@@ -68,16 +101,24 @@ function UserDashboard({ user, handleLogout }) {
     setMessage('');
 
     try {
-      const response = await axios.get(`https://stegonet-4.onrender.com/api/extract-secret/${msgId}`);
+      // Raw PNG instead of base64 in JSON: no 33% inflation and no string decoding in the browser
+      const response = await axios.get(`https://stegonet-4.onrender.com/api/extract-secret/${msgId}`, {
+        headers: { Accept: 'image/png' },
+        responseType: 'blob',
+      });
+      const url = URL.createObjectURL(response.data);
       const link = document.createElement('a');
-      link.href = `data:image/png;base64,${response.data.secret_image}`;
+      link.href = url;
       link.download = 'secret_image.png';
       link.click();
-      setMessage(response.data.message);
+      setTimeout(() => URL.revokeObjectURL(url), 1000);
+      setMessage(response.headers['x-stegonet-message'] || 'Secret image extracted');
       setTimeout(() => setMessage(''), 5000);
     } catch (err) {
-      console.error('Error extracting secret:', err.response?.data);
-      setMessage(`Error extracting secret: ${err.response?.data?.error || err.message}`);
+      // Error bodies are JSON, but arrive as a Blob because of responseType
+      const data = err.response?.data instanceof Blob ? await err.response.data.text().then(JSON.parse).catch(() => null) : err.response?.data;
+      console.error('Error extracting secret:', data);
+      setMessage(`Error extracting secret: ${data?.error || err.message}`);
     } finally {
       setIsLoading(false);
     }
@@ -148,14 +189,14 @@ function UserDashboard({ user, handleLogout }) {
               {isLoading ? 'Processing...' : 'Send Stego Image'}
             </button>
           </form>
-          {stegoImage && <img src={`data:image/png;base64,${stegoImage}`} alt="Stego" />}
+          {stegoImage && <img src={stegoImage} alt="Stego" />}
         </TabPanel>
         <TabPanel>
           <h3>Received Stego Images</h3>
           {receivedImages.map(img => (
             <div key={img.id}>
               <h4>From: {img.sender}</h4>
-              <img src={`data:image/png;base64,${img.stego_image}`} alt="Stego" />
+              <img src={`${API_BASE}${img.image_url}`} alt="Stego" loading="lazy" />
               <button onClick={() => handleExtractSecret(img.id)} disabled={isLoading}>
                 {isLoading ? 'Processing...' : 'Extract Secret'}
               </button>
@@ -164,6 +205,11 @@ function UserDashboard({ user, handleLogout }) {
               </button>
             </div>
           ))}
+          {nextCursor && (
+            <button onClick={handleLoadMore} disabled={isLoading}>
+              Load More
+            </button>
+          )}
         </TabPanel>
       </Tabs>
     </div>